@@ -0,0 +1,72 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from cache import TTLCache
+from database import Database
+
+
+class AsyncDatabase:
+    """
+    Асинхронный фасад над Database, чтобы запросы к SQLite не блокировали event loop.
+    
+    Методы Database вызываются через await: изменяющие данные выполняются по очереди
+    в одном потоке-писателе, чтения (get_*, is_*) - в пуле потоков-читателей,
+    у каждого из которых своё соединение (в режиме WAL читатели не ждут писателя).
+    """
+    
+    # Префиксы методов Database, которые только читают данные
+    READ_PREFIXES = ("get_", "is_")
+    
+    def __init__(self, db_file: str = "bot.db", readers: int = 4):
+        self.db_file = db_file
+        # Общий кэш пользователей: записи писателя сбрасывают то, что закэшировали читатели
+        self.user_cache = TTLCache(Database.USER_CACHE_SIZE, Database.USER_CACHE_TTL)
+        self._local = threading.local()
+        self._reader_dbs = []
+        self._reader_dbs_lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+        # Писатель создаёт схему до того, как к базе обратится кто-то ещё
+        self._writer_db = self._writer.submit(Database, db_file, user_cache=self.user_cache).result()
+    
+    def __getattr__(self, name: str):
+        if name.startswith("_") or name == "get_connection" or not callable(getattr(Database, name, None)):
+            raise AttributeError(name)
+        
+        if name.startswith(self.READ_PREFIXES):
+            executor, call = self._readers, partial(self._call_reader, name)
+        else:
+            executor, call = self._writer, getattr(self._writer_db, name)
+        
+        async def method(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, partial(call, *args, **kwargs))
+        
+        method.__name__ = name
+        return method
+    
+    def _call_reader(self, name: str, *args, **kwargs):
+        """Выполняет метод чтения на соединении текущего потока-читателя"""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = Database(self.db_file, read_only=True, user_cache=self.user_cache)
+            self._local.db = db
+            with self._reader_dbs_lock:
+                self._reader_dbs.append(db)
+        return getattr(db, name)(*args, **kwargs)
+    
+    async def close(self):
+        """Дожидается начатых запросов и закрывает все соединения"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._shutdown)
+    
+    def _shutdown(self):
+        self._readers.shutdown(wait=True)
+        self._writer.submit(self._writer_db.close).result()
+        self._writer.shutdown(wait=True)
+        with self._reader_dbs_lock:
+            for db in self._reader_dbs:
+                db.close()
+            self._reader_dbs.clear()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Замер скорости запросов к БД до и после создания вторичных индексов
+Использование: python3 benchmark_db.py [количество_пользователей]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from database import Database, INDEXES
+
+LOOKUPS = 2000
+
+
+def populate(db: Database, users_count: int):
+    """Заполняет БД синтетическими пользователями и рефералами"""
+    conn = db.conn
+    conn.executemany("""
+    INSERT INTO users (user_id, username, full_name, first_name, phone_number,
+                       is_registered_in_park, yandex_driver_id, park_position)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, (
+        (i, f"user{i}", f"User {i}", "User", f"+7900{i:07d}",
+         i % 2, f"driver{i}" if i % 2 else None, "express" if i % 3 else "cargo")
+        for i in range(1, users_count + 1)
+    ))
+    # Каждый второй пользователь приглашён кем-то из первой тысячи
+    conn.executemany("""
+    INSERT INTO referrals (referrer_id, referred_id, orders_count, park_position)
+    VALUES (?, ?, ?, ?)
+    """, (
+        (random.randint(1, 1000), i, random.randint(0, 60), "express")
+        for i in range(1001, users_count + 1, 2)
+    ))
+    conn.commit()
+
+
+def run_lookups(db: Database, users_count: int) -> dict:
+    """Время выполнения типичных запросов, мс на запрос"""
+    ids = [random.randint(1, users_count) for _ in range(LOOKUPS)]
+    timings = {}
+
+    def measure(name, func, args_list):
+        started = time.perf_counter()
+        for args in args_list:
+            func(*args)
+        timings[name] = (time.perf_counter() - started) * 1000 / len(args_list)
+
+    measure("get_user_by_phone", db.get_user_by_phone, [(f"+7900{i:07d}",) for i in ids])
+    measure("get_user_by_driver_id", db.get_user_by_driver_id, [(f"driver{i}",) for i in ids])
+    measure("get_user_orders_count", db.get_user_orders_count, [(i,) for i in ids])
+    measure("get_referrer_id", db.get_referrer_id, [(i,) for i in ids])
+    measure("get_referrals_for_order_check", db.get_referrals_for_order_check, [()] * 3)
+    return timings
+
+
+def main():
+    users_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    random.seed(42)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "benchmark.db"))
+        print(f"Заполняем БД: {users_count} пользователей...")
+        populate(db, users_count)
+
+        # До: без вторичных индексов
+        for name in INDEXES:
+            db.conn.execute(f"DROP INDEX IF EXISTS {name}")
+        db.conn.commit()
+        before = run_lookups(db, users_count)
+
+        # После: индексы, которые создаёт миграция схемы
+        for sql in INDEXES.values():
+            db.conn.execute(sql)
+        db.conn.execute("ANALYZE")
+        db.conn.commit()
+        after = run_lookups(db, users_count)
+        db.close()
+
+    print("=" * 80)
+    print(f"{'Запрос':35} | {'без индексов, мс':>17} | {'с индексами, мс':>16} | {'ускорение':>9}")
+    print("-" * 80)
+    for name in before:
+        speedup = before[name] / after[name] if after[name] else float("inf")
+        print(f"{name:35} | {before[name]:17.3f} | {after[name]:16.3f} | {speedup:8.1f}x")
+    print("=" * 80)
+
+
+if __name__ == "__main__":
+    main()
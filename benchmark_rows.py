@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Замер памяти и времени на строки результатов: словари против типов строк из rows.py
+Использование: python3 benchmark_rows.py [количество_строк]
+"""
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from database import Database, UserListRow
+from rows import row_factory
+
+
+def populate(db: Database, rows_count: int):
+    """Заполняет БД синтетическими пользователями"""
+    db.conn.executemany("""
+    INSERT INTO users (user_id, username, full_name, category, referrer_id, phone_number, is_registered_in_park)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (
+        (i, f"user{i}", f"User {i}", "car_courier", i // 10 or None, f"+7900{i:07d}", i % 2)
+        for i in range(1, rows_count + 1)
+    ))
+    db.conn.commit()
+
+
+def as_dicts(cursor) -> list:
+    """Словари по строкам - как Database собирал их раньше"""
+    return [
+        {
+            "user_id": row[0],
+            "username": row[1],
+            "full_name": row[2],
+            "category": row[3],
+            "referrer_id": row[4],
+            "created_at": row[5],
+            "phone_number": row[6],
+            "is_registered_in_park": row[7]
+        }
+        for row in cursor.fetchall()
+    ]
+
+
+def as_rows(cursor) -> list:
+    cursor.row_factory = row_factory(UserListRow)
+    return cursor.fetchall()
+
+
+def measure(db: Database, build) -> tuple:
+    """Время выборки и память, которую занимает результат (МиБ)"""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    cursor = db.conn.cursor()
+    cursor.execute("""
+    SELECT user_id, username, full_name, category, referrer_id, created_at, phone_number, is_registered_in_park
+    FROM users
+    ORDER BY created_at DESC
+    """)
+    result = build(cursor)
+    elapsed = time.perf_counter() - started
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # Проверяем, что обращение по ключу работает одинаково
+    assert result[0]["user_id"] == result[0].get("user_id")
+    del result
+    return elapsed, memory / 1024 / 1024
+
+
+def main():
+    rows_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "benchmark.db"))
+        populate(db, rows_count)
+        dict_time, dict_memory = measure(db, as_dicts)
+        row_time, row_memory = measure(db, as_rows)
+        db.close()
+    
+    print("=" * 60)
+    print(f"Строк: {rows_count}")
+    print(f"{'':12} | {'время, с':>10} | {'память, МиБ':>12}")
+    print("-" * 60)
+    print(f"{'dict':12} | {dict_time:10.3f} | {dict_memory:12.1f}")
+    print(f"{'UserListRow':12} | {row_time:10.3f} | {row_memory:12.1f}")
+    print(f"Экономия памяти: {(1 - row_memory / dict_memory) * 100:.0f}%")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Замер задержки обработки обновлений в режиме webhook без Telegram
+Использование: python3 benchmark_webhook.py [количество_обновлений] [одновременных_запросов]
+
+Поднимает поддельный Bot API (отвечает на любой метод), направляет в него бота из bot.py,
+запускает WebhookServer и отправляет синтетические обновления (/start и "👤 Профиль" от новых
+пользователей). Задержка - от отправки обновления до первого запроса обработчика к Bot API.
+БД и хранилище FSM создаются во временной директории.
+"""
+import asyncio
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import time
+
+from aiohttp import ClientSession, web
+
+BOT_TOKEN = "123456:BENCHMARK"
+SECRET = "benchmark"
+REPLY_TIMEOUT = 30
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class FakeBotAPI:
+    """Поддельный Bot API: запоминает время первого запроса для каждого chat_id"""
+
+    def __init__(self):
+        self.replies = {}  # chat_id -> время первого ответа бота
+        self.app = web.Application()
+        self.app.router.add_post("/bot{token}/{method}", self.handle)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        data = dict(await request.post())
+        chat_id = data.get("chat_id")
+        if chat_id is not None:
+            self.replies.setdefault(int(chat_id), time.perf_counter())
+
+        if request.match_info["method"] in ("sendMessage", "editMessageText"):
+            result = {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": int(chat_id or 0), "type": "private"},
+                "text": data.get("text", "")
+            }
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+
+def make_update(update_id: int, user_id: int) -> dict:
+    """Синтетическое обновление: /start для чётных update_id, кнопка профиля для нечётных"""
+    text = "/start" if update_id % 2 == 0 else "👤 Профиль"
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "Тест", "username": f"user{user_id}"},
+        "text": text
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+    return {"update_id": update_id, "message": message}
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run(updates_count: int, concurrency: int):
+    import bot as bot_module
+    from aiogram.bot.api import TelegramAPIServer
+    from webhook import WebhookServer
+
+    fake_api = FakeBotAPI()
+    api_runner = web.AppRunner(fake_api.app)
+    await api_runner.setup()
+    api_port = free_port()
+    await web.TCPSite(api_runner, "127.0.0.1", api_port).start()
+    bot_module.bot.server = TelegramAPIServer.from_base(f"http://127.0.0.1:{api_port}")
+
+    server = WebhookServer(bot_module.dp, "/webhook", SECRET)
+    port = free_port()
+    await server.start("127.0.0.1", port)
+    url = f"http://127.0.0.1:{port}/webhook"
+
+    sent_at = {}
+    ack_latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def post(session: ClientSession, update_id: int):
+        user_id = 1_000_000 + update_id
+        async with semaphore:
+            started = time.perf_counter()
+            sent_at[user_id] = started
+            async with session.post(url, json=make_update(update_id, user_id),
+                                    headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}) as response:
+                await response.read()
+                ack_latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(post(session, i) for i in range(updates_count)))
+        deadline = time.perf_counter() + REPLY_TIMEOUT
+        while len(fake_api.replies) < updates_count and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+        async with session.get(f"http://127.0.0.1:{port}/health") as response:
+            health = await response.json()
+
+    await server.stop()
+    await api_runner.cleanup()
+    await bot_module.db.close()
+    await bot_module.dp.storage.close()
+    await (await bot_module.bot.get_session()).close()
+
+    latencies = [fake_api.replies[user_id] - sent_at[user_id] for user_id in fake_api.replies if user_id in sent_at]
+    print("=" * 60)
+    print(f"Обновлений: {updates_count}, одновременно: {concurrency}, ответов: {len(latencies)}")
+    print(f"Пропускная способность: {len(latencies) / elapsed:.1f} обновлений/с")
+    print(f"Состояние сервера: {health}")
+    print("-" * 60)
+    print(f"{'мс':24} | {'p50':>8} | {'p95':>8} | {'p99':>8} | {'max':>8}")
+    for name, values in (("подтверждение webhook", ack_latencies), ("до ответа обработчика", latencies)):
+        if values:
+            ms = [v * 1000 for v in values]
+            print(f"{name:24} | {statistics.median(ms):8.2f} | {percentile(ms, 0.95):8.2f} | "
+                  f"{percentile(ms, 0.99):8.2f} | {max(ms):8.2f}")
+    print("=" * 60)
+
+
+def main():
+    updates_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    # bot.py создаёт БД и хранилище FSM в текущей директории при импорте
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.environ["BOT_TOKEN"] = BOT_TOKEN
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        asyncio.run(run(updates_count, concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,21 @@
 import asyncio
 import logging
 import re
+import signal
+from datetime import datetime, timezone
+from typing import Optional
+from urllib.parse import urlsplit
 from aiogram import Bot, Dispatcher, types
 from aiogram.dispatcher.filters import CommandStart
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
-from config import BOT_TOKEN, NOTIFICATION_CHANNEL_ID, YANDEX_PARK_ID, YANDEX_API_KEY, YANDEX_CLIENT_ID, ADMIN_USER_IDS
-from database import Database
+from config import BOT_TOKEN, NOTIFICATION_CHANNEL_ID, YANDEX_PARK_ID, YANDEX_API_KEY, YANDEX_CLIENT_ID, ADMIN_USER_IDS, YANDEX_API_RPS, YANDEX_API_MAX_RPS, ORDERS_THRESHOLD
+from config import BOT_MODE, WEBHOOK_URL, WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_SECRET
+from async_database import AsyncDatabase
+from cache import TTLCache
+from sqlite_storage import SQLiteStorage
+from webhook import WebhookServer, check_webhook_url
 from yandex_park_api import YandexParkAPI
 
 # Настройка логирования
@@ -18,11 +25,11 @@ logging.basicConfig(
 )
 
 # Инициализация бота, диспетчера и БД
-storage = MemoryStorage()
+storage = SQLiteStorage()
 bot = Bot(token=BOT_TOKEN)
 dp = Dispatcher(bot, storage=storage)
-db = Database()
-yandex_api = YandexParkAPI(YANDEX_PARK_ID, YANDEX_API_KEY, YANDEX_CLIENT_ID)
+db = AsyncDatabase()
+yandex_api = YandexParkAPI(YANDEX_PARK_ID, YANDEX_API_KEY, YANDEX_CLIENT_ID, YANDEX_API_RPS, YANDEX_API_MAX_RPS)
 
 # Состояния для FSM
 class RegistrationStates(StatesGroup):
@@ -35,8 +42,18 @@ class AdminStates(StatesGroup):
     waiting_for_search_phone = State()
 
 
-# Словарь для хранения данных пользователей (временно)
-user_data = {}
+# Временные данные регистрации: user_id -> dict. Ограничены по размеру и времени простоя, чтобы
+# брошенные /start не копились в памяти; вытесненные данные восстанавливаются из состояния FSM
+USER_DATA_MAX_SIZE = 10000
+USER_DATA_TTL = 3600
+USER_DATA_SWEEP_INTERVAL = 300
+user_data = TTLCache(USER_DATA_MAX_SIZE, USER_DATA_TTL, sliding=True)
+
+# Насколько старое (в секундах) количество заказов из кэша API можно показывать в интерфейсе
+ORDERS_MAX_STALENESS = 600
+
+# Рефералов на одной странице "📋 Все рефералы" (так сообщение укладывается в лимит Telegram в 4096 символов)
+REFERRALS_PAGE_SIZE = 8
 
 # Требования к документам
 DOCUMENT_REQUIREMENTS = {
@@ -142,12 +159,12 @@ async def cmd_start(message: types.Message, state: FSMContext):
             referrer_id = None
     
     # Проверяем, зарегистрирован ли пользователь
-    existing_user = db.get_user(user.id)
+    existing_user = await db.get_user(user.id)
     
     # Пользователь считается зарегистрированным только если у него есть номер телефона
     if existing_user and existing_user.get('phone_number'):
         # Пользователь уже зарегистрирован, показываем главное меню
-        is_admin = db.is_admin(user.id)
+        is_admin = await db.is_admin(user.id)
         await message.answer(
             f"👋 С возвращением, {user.first_name}!",
             reply_markup=get_main_menu_keyboard(is_admin)
@@ -155,7 +172,7 @@ async def cmd_start(message: types.Message, state: FSMContext):
         return
     
     # Инициализируем данные нового пользователя
-    user_data[user.id] = {
+    user_data.set(user.id, {
         "category": None,
         "phone_number": None,
         "referrer_id": referrer_id,
@@ -165,12 +182,14 @@ async def cmd_start(message: types.Message, state: FSMContext):
             "full_name": user.full_name,
             "first_name": user.first_name
         }
-    }
+    })
+    # referrer_id хранится и в состоянии FSM, чтобы пережить перезапуск бота посреди регистрации
+    await state.update_data(referrer_id=referrer_id)
     
     # Приветствие с упоминанием реферала
     welcome_text = f"👋 Здравствуйте, {user.first_name}!\n\n"
     if referrer_id:
-        referrer = db.get_user(referrer_id)
+        referrer = await db.get_user(referrer_id)
         if referrer:
             welcome_text += f"Вы приглашены пользователем {referrer['full_name']}!\n\n"
     
@@ -211,7 +230,23 @@ async def process_phone(message: types.Message, state: FSMContext):
     elif not cleaned_phone.startswith('+'):
         cleaned_phone = '+7' + cleaned_phone
     
-    user_data[user_id]["phone_number"] = cleaned_phone
+    # После перезапуска бота или вытеснения из user_data восстанавливаем данные из состояния FSM
+    registration = user_data.get(user_id)
+    if registration is None:
+        state_data = await state.get_data()
+        registration = {
+            "category": None,
+            "phone_number": None,
+            "referrer_id": state_data.get("referrer_id"),
+            "user_info": {
+                "id": user_id,
+                "username": message.from_user.username,
+                "full_name": message.from_user.full_name,
+                "first_name": message.from_user.first_name
+            }
+        }
+        user_data.set(user_id, registration)
+    registration["phone_number"] = cleaned_phone
     
     # Отправляем сообщение о проверке
     checking_msg = await message.answer("🔍 Проверяю регистрацию в Яндекс Парке...")
@@ -244,19 +279,27 @@ async def process_phone(message: types.Message, state: FSMContext):
         
         # Сохраняем пользователя с отметкой о регистрации в парке
         # Если пользователь уже в парке, не учитываем его как реферала (referrer_id=None)
-        user_info = user_data[user_id]["user_info"]
-        referrer_id = user_data[user_id].get("referrer_id")  # Сохраняем referrer_id из реферальной ссылки
+        user_info = registration["user_info"]
+        referrer_id = registration.get("referrer_id")  # Сохраняем referrer_id из реферальной ссылки
         
         # Определяем позицию водителя в парке
         park_position = None
         driver_id = driver_info.get("driver_id")
         if driver_id:
-            park_position = await yandex_api.get_driver_position(driver_id)
+            # Сохранённая позиция или классификация по автомобилю из найденного профиля -
+            # без повторного запроса к API во время регистрации
+            cached_position = await db.get_driver_position(driver_id)
+            if cached_position:
+                park_position = cached_position["park_position"]
+            else:
+                car = driver_info.get("car") or {}
+                park_position = YandexParkAPI.classify_position(car)
+                await db.save_driver_position(driver_id, park_position, car)
             logging.info(f"Определена позиция водителя {driver_id}: {park_position}")
         
         # Сохраняем пользователя с реферальной информацией
         # ВАЖНО: referrer_id НЕ обнуляем, даже если пользователь уже в парке
-        db.add_user(
+        await db.add_user(
             user_id=user_info["id"],
             username=user_info["username"],
             full_name=user_info["full_name"],
@@ -273,19 +316,8 @@ async def process_phone(message: types.Message, state: FSMContext):
         # Если есть реферер И пользователь уже в парке, создаем запись реферала с позицией
         if referrer_id:
             # Создаем запись в referrals для отслеживания позиции и заказов
-            conn = db.get_connection()
-            cursor = conn.cursor()
-            try:
-                cursor.execute("""
-                INSERT OR IGNORE INTO referrals (referrer_id, referred_id, park_position)
-                VALUES (?, ?, ?)
-                """, (referrer_id, user_info["id"], park_position))
-                conn.commit()
+            if await db.add_referral(referrer_id, user_info["id"], park_position):
                 logging.info(f"Добавлен реферал (уже в парке): referrer_id={referrer_id}, referred_id={user_info['id']}, park_position={park_position}")
-            except Exception as e:
-                logging.error(f"Ошибка при добавлении реферала: {e}")
-            finally:
-                conn.close()
         
         # Формируем сообщение с информацией о водителе
         info_text = (
@@ -307,7 +339,7 @@ async def process_phone(message: types.Message, state: FSMContext):
         await checking_msg.edit_text(info_text, parse_mode="HTML")
         
         # Показываем главное меню
-        is_admin = db.is_admin(user_id)
+        is_admin = await db.is_admin(user_id)
         await message.answer(
             "Главное меню:",
             reply_markup=get_main_menu_keyboard(is_admin)
@@ -319,9 +351,9 @@ async def process_phone(message: types.Message, state: FSMContext):
         
     else:
         # Водитель не найден, сохраняем пользователя и предлагаем выбрать категорию позже
-        referrer_id = user_data[user_id].get("referrer_id")
-        user_info = user_data[user_id]["user_info"]
-        db.add_user(
+        referrer_id = registration.get("referrer_id")
+        user_info = registration["user_info"]
+        await db.add_user(
             user_id=user_info["id"],
             username=user_info["username"],
             full_name=user_info["full_name"],
@@ -337,7 +369,7 @@ async def process_phone(message: types.Message, state: FSMContext):
             parse_mode="HTML"
         )
         # Показываем главное меню сразу, чтобы были видны кнопки
-        is_admin = db.is_admin(user_id)
+        is_admin = await db.is_admin(user_id)
         await message.answer(
             "Главное меню:",
             reply_markup=get_main_menu_keyboard(is_admin)
@@ -351,7 +383,7 @@ async def process_phone(message: types.Message, state: FSMContext):
 async def start_work_flow(message: types.Message, state: FSMContext):
     """Запуск выбора категории для подключения"""
     user_id = message.from_user.id
-    user = db.get_user(user_id)
+    user = await db.get_user(user_id)
     if not user or not user.get("phone_number"):
         await message.answer("Сначала отправьте номер телефона через /start.")
         return
@@ -359,8 +391,8 @@ async def start_work_flow(message: types.Message, state: FSMContext):
         await message.answer("Вы уже зарегистрированы в Яндекс Парке.")
         return
     # Готовим данные в user_data (для referrer/username)
-    if user_id not in user_data:
-        user_data[user_id] = {
+    if user_data.get(user_id) is None:
+        user_data.set(user_id, {
             "category": None,
             "phone_number": user.get("phone_number") if user else None,
             "referrer_id": user.get("referrer_id") if user else None,
@@ -370,7 +402,7 @@ async def start_work_flow(message: types.Message, state: FSMContext):
                 "full_name": user.get("full_name") if user else message.from_user.full_name,
                 "first_name": user.get("first_name") if user else message.from_user.first_name,
             }
-        }
+        })
     await message.answer(
         "Выберите вашу категорию:",
         reply_markup=get_category_keyboard()
@@ -387,20 +419,16 @@ async def process_category_selection(callback_query: types.CallbackQuery, state:
     category = callback_query.data.split(":")[1]
     
     # Обновляем данные и БД
-    if user_id not in user_data:
-        user_data[user_id] = {"user_info": {"id": user_id, "username": callback_query.from_user.username,
-                                            "full_name": callback_query.from_user.full_name,
-                                            "first_name": callback_query.from_user.first_name}}
-    user_data[user_id]["category"] = category
+    registration = user_data.get(user_id)
+    if registration is None:
+        registration = {"user_info": {"id": user_id, "username": callback_query.from_user.username,
+                                      "full_name": callback_query.from_user.full_name,
+                                      "first_name": callback_query.from_user.first_name}}
+        user_data.set(user_id, registration)
+    registration["category"] = category
     
     # Обновляем категорию в БД (если запись уже есть после ввода телефона)
-    conn = db.get_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("UPDATE users SET category = ? WHERE user_id = ?", (category, user_id))
-        conn.commit()
-    finally:
-        conn.close()
+    await db.update_user_category(user_id, category)
     
     # Отправляем уведомление в канал
     await send_notification_to_channel_simple(user_id, category, callback_query.bot)
@@ -418,11 +446,11 @@ async def process_category_selection(callback_query: types.CallbackQuery, state:
 async def send_notification_to_channel_simple(user_id: int, category: str, bot: Bot):
     """Отправляет текстовое уведомление в канал о новой заявке без фотографий"""
     try:
-        user = db.get_user(user_id)
+        user = await db.get_user(user_id)
         cat = DOCUMENT_REQUIREMENTS.get(category, {})
         referrer_text = ""
         if user and user.get("referrer_id"):
-            referrer = db.get_user(user.get("referrer_id"))
+            referrer = await db.get_user(user.get("referrer_id"))
             if referrer:
                 ref_username = referrer.get("username")
                 ref_link = f"@{ref_username}" if ref_username else f'<a href="tg://user?id={referrer.get("user_id")}">профиль</a>'
@@ -468,12 +496,12 @@ async def show_referral_link(message: types.Message, state: FSMContext):
     # Добавляем zero-width space, чтобы ссылка не автокликалась и её было удобно копировать
     copy_safe_link = referral_link.replace("https://", "https://\u2060")
     
-    user = db.get_user(user_id)
+    user = await db.get_user(user_id)
     if not user:
         await message.answer("Сначала пройдите регистрацию, отправив /start")
         return
     
-    stats = db.get_user_stats(user_id)
+    stats = await db.get_user_stats(user_id)
     
     referral_text = (
         "🔗 <b>Ваша реферальная ссылка:</b>\n"
@@ -486,51 +514,62 @@ async def show_referral_link(message: types.Message, state: FSMContext):
     await message.answer(referral_text, parse_mode="HTML")
 
 
+# Фоновые обновления заказов для профиля: referrer_id -> задача (не больше одной на реферера)
+profile_refresh_tasks = {}
+# Сообщения профиля, ожидающие обновления: referrer_id -> [(сообщение, показанный текст)]
+profile_messages = {}
+# После начала остановки бота новые фоновые обновления профиля не запускаются
+profile_refresh_stopped = False
+# Сколько при остановке ждать начатых фоновых обновлений профиля, секунд
+PROFILE_REFRESH_SHUTDOWN_TIMEOUT = 10
+
+
+def parse_db_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """Время из БД (CURRENT_TIMESTAMP SQLite, UTC)"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+
+def referral_orders_stale(ref) -> bool:
+    """Нужно ли обновить заказы реферала из API (зарегистрирован в парке и данные старше ORDERS_MAX_STALENESS)"""
+    if not ref.get('is_registered_in_park') or not ref.get('yandex_driver_id'):
+        return False
+    updated_at = parse_db_timestamp(ref.get('orders_updated_at'))
+    return updated_at is None or (datetime.now(timezone.utc) - updated_at).total_seconds() > ORDERS_MAX_STALENESS
+
+
 async def update_referrals_orders(user_id: int):
-    """Обновляет данные о заказах для рефералов пользователя"""
-    referrals = db.get_referrals(user_id)
-    updated_count = 0
+    """Обновляет данные о заказах для рефералов пользователя, у которых они устарели"""
+    referrals = await db.get_referrals(user_id)
     
-    for ref in referrals:
-        user_ref = db.get_user(ref['user_id'])
-        if user_ref and user_ref.get('is_registered_in_park') and user_ref.get('yandex_driver_id'):
-            try:
-                yandex_driver_id = user_ref['yandex_driver_id']
-                orders_count = await yandex_api.get_driver_orders_count(yandex_driver_id)
-                if orders_count is not None:
-                    db.update_orders_count(ref['user_id'], orders_count)
-                    updated_count += 1
-                    logging.info(f"Обновлены заказы для user_id={ref['user_id']}, driver_id={yandex_driver_id}, заказов={orders_count}")
-                else:
-                    logging.warning(f"Не удалось получить заказы для user_id={ref['user_id']}, driver_id={yandex_driver_id}")
-                # Увеличиваем задержку, чтобы избежать 429 ошибок (лимит API)
-                await asyncio.sleep(2.0)  # Увеличенная задержка, чтобы избежать 429 ошибок
-            except Exception as e:
-                logging.error(f"Ошибка при обновлении заказов для {ref['user_id']}: {e}", exc_info=True)
+    async def refresh(ref) -> bool:
+        yandex_driver_id = ref['yandex_driver_id']
+        try:
+            orders_count = await yandex_api.get_driver_orders_count(yandex_driver_id, max_age=ORDERS_MAX_STALENESS)
+            if orders_count is None:
+                logging.warning(f"Не удалось получить заказы для user_id={ref['user_id']}, driver_id={yandex_driver_id}")
+                return False
+            await db.update_orders_count(ref['user_id'], orders_count)
+            logging.info(f"Обновлены заказы для user_id={ref['user_id']}, driver_id={yandex_driver_id}, заказов={orders_count}")
+            return True
+        except Exception as e:
+            logging.error(f"Ошибка при обновлении заказов для {ref['user_id']}: {e}", exc_info=True)
+            return False
     
-    return updated_count
+    # Запросы идут параллельно, темп обращений к API держит rate limiter клиента
+    results = await asyncio.gather(*(refresh(ref) for ref in referrals if referral_orders_stale(ref)))
+    return sum(results)
 
 
-@dp.message_handler(lambda message: message.text == "👤 Профиль", state="*")
-async def show_profile(message: types.Message, state: FSMContext):
-    """Показать профиль пользователя"""
-    user_id = message.from_user.id
-    user = db.get_user(user_id)
-    
-    if not user:
-        await message.answer("Сначала пройдите регистрацию, отправив /start")
-        return
-    
-    # Обновляем данные о заказах перед показом профиля
-    msg = await message.answer("🔄 Обновляю данные о заказах...")
-    updated = await update_referrals_orders(user_id)
-    if updated > 0:
-        await msg.edit_text(f"✅ Обновлено данных: {updated}")
-        await asyncio.sleep(1)
-        await msg.delete()
-    
-    referrals = db.get_referrals(user_id)
-    stats = db.get_user_stats(user_id)
+async def build_profile_text(user) -> tuple:
+    """Текст профиля по данным из БД и признак того, что заказы рефералов пора обновить"""
+    user_id = user['user_id']
+    referrals = await db.get_referrals(user_id)
+    stats = await db.get_user_stats(user_id)
     
     profile_text = (
         f"👤 <b>Ваш профиль</b>\n\n"
@@ -557,10 +596,9 @@ async def show_profile(message: types.Message, state: FSMContext):
         for ref in referrals[:10]:  # Показываем первые 10
             
             orders_info = ""
-            user_ref = db.get_user(ref['user_id'])
             # Показываем заказы если реферал зарегистрирован в парке ИЛИ если есть данные о заказах
             orders_count = ref.get('orders_count', 0)
-            if user_ref and user_ref.get('is_registered_in_park') and orders_count > 0:
+            if ref.get('is_registered_in_park') and orders_count > 0:
                 # Показываем количество заказов
                 orders_info = f"   📈 <b>Заказов: {orders_count}</b>\n"
             elif orders_count > 0:
@@ -573,8 +611,95 @@ async def show_profile(message: types.Message, state: FSMContext):
                 f"{orders_info}"
                 f"📅 {ref['created_at'][:10]}\n\n"
             )
+        
+        # Самые старые из показанных данных о заказах
+        updated_times = [t for t in (parse_db_timestamp(ref.get('orders_updated_at')) for ref in referrals[:10]) if t]
+        if updated_times:
+            profile_text += f"🕒 Заказы обновлены: {min(updated_times).astimezone().strftime('%d.%m.%Y %H:%M')}\n"
+    
+    return profile_text, any(referral_orders_stale(ref) for ref in referrals)
+
+
+async def refresh_profile(user_id: int):
+    """Обновляет заказы рефералов в фоне и перерисовывает ожидающие сообщения профиля"""
+    try:
+        await update_referrals_orders(user_id)
+    finally:
+        messages = profile_messages.pop(user_id, [])
+    
+    user = await db.get_user(user_id)
+    if not user or not messages:
+        return
+    profile_text, _ = await build_profile_text(user)
+    for msg, shown_text in messages:
+        if profile_text == shown_text:
+            continue
+        try:
+            await msg.edit_text(profile_text, parse_mode="HTML")
+        except Exception as e:
+            logging.warning(f"Не удалось обновить сообщение профиля для {user_id}: {e}")
+
+
+def schedule_profile_refresh(user_id: int, msg: types.Message, shown_text: str):
+    """Запускает фоновое обновление профиля, если оно ещё не идёт для этого пользователя"""
+    if profile_refresh_stopped:
+        return
+    profile_messages.setdefault(user_id, []).append((msg, shown_text))
+    if user_id not in profile_refresh_tasks:
+        start_profile_refresh(user_id)
+
+
+def start_profile_refresh(user_id: int):
+    task = asyncio.create_task(refresh_profile(user_id))
+    profile_refresh_tasks[user_id] = task
+    
+    def on_done(task: asyncio.Task):
+        profile_refresh_tasks.pop(user_id, None)
+        if task.cancelled():
+            profile_messages.pop(user_id, None)
+            return
+        if task.exception():
+            logging.error(f"Ошибка при фоновом обновлении профиля {user_id}: {task.exception()}")
+        # Сообщения, показанные после того, как задача забрала свои, обновляет следующая задача
+        if profile_messages.get(user_id) and not profile_refresh_stopped:
+            start_profile_refresh(user_id)
+        else:
+            profile_messages.pop(user_id, None)
+    
+    task.add_done_callback(on_done)
+
+
+async def stop_profile_refreshes(timeout: float = PROFILE_REFRESH_SHUTDOWN_TIMEOUT):
+    """Дожидается фоновых обновлений профиля (не дольше timeout), отменяет оставшиеся и не запускает новые"""
+    global profile_refresh_stopped
+    profile_refresh_stopped = True
+    tasks = list(profile_refresh_tasks.values())
+    if not tasks:
+        return
+    _, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+
+@dp.message_handler(lambda message: message.text == "👤 Профиль", state="*")
+async def show_profile(message: types.Message, state: FSMContext):
+    """Показать профиль пользователя (сразу из БД, заказы обновляются в фоне)"""
+    user_id = message.from_user.id
+    user = await db.get_user(user_id)
     
-    await message.answer(profile_text, parse_mode="HTML")
+    if not user:
+        await message.answer("Сначала пройдите регистрацию, отправив /start")
+        return
+    
+    profile_text, needs_refresh = await build_profile_text(user)
+    if not needs_refresh:
+        await message.answer(profile_text, parse_mode="HTML")
+        return
+    
+    shown_text = profile_text + "🔄 Обновляю данные о заказах...\n"
+    msg = await message.answer(shown_text, parse_mode="HTML")
+    schedule_profile_refresh(user_id, msg, shown_text)
 
 
 def format_position_line(user: dict) -> str:
@@ -593,26 +718,36 @@ def format_position_line(user: dict) -> str:
     return "🏷️ Позиция: не указана"
 
 
-async def fetch_orders_live(user: dict) -> int:
-    """Получает актуальное число заказов из Яндекс Парка, обновляет БД, возвращает число"""
+async def fetch_orders_live(user: dict, max_age: Optional[float] = ORDERS_MAX_STALENESS) -> Optional[int]:
+    """
+    Получает актуальное число заказов из Яндекс Парка, обновляет БД, возвращает число.
+    None - заказы получить не удалось (ошибка API, водитель не найден); в БД тогда ничего не пишется
+    
+    max_age - допустимый возраст значения из кэша клиента API. Явное обновление передаёт None:
+    иначе старое закэшированное число перезаписало бы более новое, записанное order_checker
+    """
     if not user:
-        return 0
+        return None
     driver_id = user.get("yandex_driver_id")
     phone = user.get("phone_number")
-    orders = 0
+    orders = None
     try:
+        if max_age is None and driver_id:
+            # Принудительное обновление: даже если запрос не удастся, старое число из кэша больше не отдаём
+            yandex_api.invalidate_orders_count(driver_id)
         if user.get("is_registered_in_park") and driver_id:
-            orders = await yandex_api.get_driver_orders_count(driver_id) or 0
+            orders = await yandex_api.get_driver_orders_count(driver_id, max_age=max_age)
         elif phone:
             info = await yandex_api.check_driver_by_phone(phone)
             if info and info.get("found"):
                 driver_id = info.get("driver_id")
-                orders = await yandex_api.get_driver_orders_count(driver_id) or 0
-        if user.get("user_id"):
-            db.update_orders_count(user["user_id"], orders)
+                orders = await yandex_api.get_driver_orders_count(driver_id, max_age=max_age)
+        if orders is None:
+            logging.warning(f"[ADMIN_REFERRALS] Не удалось получить заказы для user {user.get('user_id')}, driver_id={driver_id}")
+        elif user.get("user_id"):
+            await db.update_orders_count(user["user_id"], orders)
     except Exception as e:
         logging.error(f"[ADMIN_REFERRALS] Ошибка получения заказов для user {user.get('user_id')}: {e}", exc_info=True)
-    await asyncio.sleep(0.3)  # чуть притормозить, чтобы не ловить 429
     return orders
 
 
@@ -621,7 +756,7 @@ async def show_admin_panel(message: types.Message, state: FSMContext):
     """Админ-панель"""
     user_id = message.from_user.id
     
-    if not db.is_admin(user_id):
+    if not await db.is_admin(user_id):
         await message.answer("У вас нет прав администратора")
         return
     
@@ -635,7 +770,7 @@ async def show_admin_panel(message: types.Message, state: FSMContext):
 @dp.message_handler(lambda message: message.text == "🔍 Поиск по номеру", state="*")
 async def admin_search_start(message: types.Message, state: FSMContext):
     """Начало поиска пользователя по номеру телефона"""
-    if not db.is_admin(message.from_user.id):
+    if not await db.is_admin(message.from_user.id):
         return
     
     await message.answer(
@@ -648,11 +783,11 @@ async def admin_search_start(message: types.Message, state: FSMContext):
 @dp.message_handler(state=AdminStates.waiting_for_search_phone)
 async def admin_process_search_phone(message: types.Message, state: FSMContext):
     """Обработка введенного номера телефона и поиск"""
-    if not db.is_admin(message.from_user.id):
+    if not await db.is_admin(message.from_user.id):
         await state.finish()
         return
 
-    is_admin = db.is_admin(message.from_user.id)
+    is_admin = await db.is_admin(message.from_user.id)
     phone = message.text.strip()
     
     # Сбрасываем состояние FSM
@@ -671,7 +806,7 @@ async def admin_process_search_phone(message: types.Message, state: FSMContext):
 
     # Ищем в БД бота (быстро)
     try:
-        user_in_db = db.get_user_by_phone(normalized_phone)
+        user_in_db = await db.get_user_by_phone(normalized_phone)
     except Exception as e:
         logging.error(f"Ошибка при поиске в БД: {e}")
         user_in_db = None
@@ -725,20 +860,21 @@ async def admin_process_search_phone(message: types.Message, state: FSMContext):
         status = status_map.get(driver_in_park.get('work_status'), "-")
         
         driver_id = driver_in_park.get("driver_id")
-        orders_count = 0
+        orders_count = None
         if driver_id:
             try:
                 logging.info(f"[ADMIN_SEARCH] Запрос заказов из парка для driver_id={driver_id}")
-                orders_count = await yandex_api.get_driver_orders_count(driver_id) or 0
-                if user_in_db and user_in_db.get('user_id'):
-                    db.update_orders_count(user_in_db['user_id'], orders_count)
+                orders_count = await yandex_api.get_driver_orders_count(driver_id, max_age=ORDERS_MAX_STALENESS)
+                # При ошибке API (None) сохранённое количество не затираем
+                if orders_count is not None and user_in_db and user_in_db.get('user_id'):
+                    await db.update_orders_count(user_in_db['user_id'], orders_count)
             except Exception as e:
                 logging.error(f"[ADMIN_SEARCH] ❌ Ошибка получения заказов: {e}", exc_info=True)
         
         park_block = [
             f"👤 ФИО: {driver_name}",
             f"📊 Статус: {status}",
-            f"📈 Выполнено заказов: {orders_count}"
+            f"📈 Выполнено заказов: {orders_count if orders_count is not None else 'нет данных'}"
         ]
         parts.append("\n".join(park_block))
     else:
@@ -754,22 +890,9 @@ async def admin_process_search_phone(message: types.Message, state: FSMContext):
         # Показываем, кто пригласил (ищем в users.referrer_id, а при отсутствии — в referrals)
         referrer_id = user_in_db.get('referrer_id')
         if not referrer_id:
-            try:
-                conn = db.get_connection()
-                cur = conn.cursor()
-                cur.execute("SELECT referrer_id FROM referrals WHERE referred_id = ? LIMIT 1", (user_in_db.get('user_id'),))
-                row = cur.fetchone()
-                if row and row[0]:
-                    referrer_id = row[0]
-            except Exception as e:
-                logging.error(f"Ошибка при поиске referrer_id в referrals: {e}")
-            finally:
-                try:
-                    conn.close()
-                except:
-                    pass
+            referrer_id = await db.get_referrer_id(user_in_db.get('user_id'))
         if referrer_id:
-            ref = db.get_user(referrer_id)
+            ref = await db.get_user(referrer_id)
             if ref:
                 ref_username = ref.get('username')
                 ref_phone = ref.get('phone_number') or 'не указан'
@@ -783,7 +906,7 @@ async def admin_process_search_phone(message: types.Message, state: FSMContext):
         
         # --- Приглашенные им пользователи ---
         try:
-            invited_users = db.get_invited_users_with_order_count(user_in_db['user_id'])
+            invited_users = await db.get_invited_users_with_order_count(user_in_db['user_id'])
             if invited_users:
                 invite_blocks = []
                 for ref in invited_users:
@@ -819,103 +942,142 @@ async def admin_process_search_phone(message: types.Message, state: FSMContext):
         )
 
 
+def referral_party(rec, prefix: str) -> dict:
+    """Данные пригласившего (prefix="referrer_") или приглашённого (prefix="referred_") из строки get_referral_stats"""
+    return {key[len(prefix):]: value for key, value in rec.items() if key.startswith(prefix)}
+
+
+def uname_link(user: dict) -> str:
+    """Ссылка на пользователя: @username или tg://user"""
+    if user.get("username"):
+        return f"@{user['username']}"
+    if user.get("user_id"):
+        return f'<a href="tg://user?id={user["user_id"]}">профиль</a>'
+    return "нет username"
+
+
+async def referral_eta(rec) -> Optional[float]:
+    """
+    Через сколько суток реферал наберёт порог заказов своей позиции (по истории orders_log).
+    None - позиция без порога или истории недостаточно
+    """
+    threshold = ORDERS_THRESHOLD.get(rec["referred_park_position"])
+    if not threshold or not rec["referred_user_id"]:
+        return None
+    return await db.get_order_eta(rec["referred_user_id"], threshold)
+
+
+def format_referral_block(rec, eta: Optional[float] = None) -> str:
+    """Блок с рефералом и пригласившим для списка «📋 Все рефералы»"""
+    referred = referral_party(rec, "referred_")
+    referrer = referral_party(rec, "referrer_")
+    orders_line = f"📈 Заказов: {rec['orders_count']}"
+    if eta:
+        orders_line += f" (до цели ≈ {max(1, round(eta))} дн.)"
+    return "\n".join([
+        format_position_line(referred),
+        f"👤 Имя в Telegram: {referred.get('full_name') or 'Не указано'}",
+        f"📱 Username: {uname_link(referred)}",
+        f"📞 Телефон: {referred.get('phone_number') or 'не указан'}",
+        orders_line,
+        "",
+        "👥 Пользователя пригласил:",
+        format_position_line(referrer),
+        f"👤 Имя в Telegram: {referrer.get('full_name') or 'Не указано'}",
+        f"📱 Username: {uname_link(referrer)}",
+        f"📞 Телефон: {referrer.get('phone_number') or 'не указан'}",
+    ])
+
+
+async def build_referrals_page(page: int, refresh: bool = False) -> tuple:
+    """
+    Текст и клавиатура страницы "📋 Все рефералы" по данным из БД.
+    При refresh заказы рефералов на странице сначала обновляются из API (параллельно).
+    """
+    total = await db.get_referral_stats_count()
+    if not total:
+        return "ℹ️ Рефералов пока нет.", None
+    
+    pages = (total + REFERRALS_PAGE_SIZE - 1) // REFERRALS_PAGE_SIZE
+    page = max(0, min(page, pages - 1))
+    stats = await db.get_referral_stats(page * REFERRALS_PAGE_SIZE, REFERRALS_PAGE_SIZE)
+    
+    if refresh:
+        # Кнопка «Обновить заказы» - всегда свежие данные из API, без кэша клиента
+        await asyncio.gather(*(fetch_orders_live(referral_party(rec, "referred_"), max_age=None) for rec in stats))
+        stats = await db.get_referral_stats(page * REFERRALS_PAGE_SIZE, REFERRALS_PAGE_SIZE)
+    
+    etas = await asyncio.gather(*(referral_eta(rec) for rec in stats))
+    text = (
+        f"📋 <b>Все рефералы</b> (стр. {page + 1}/{pages}, всего {total})\n\n"
+        + "\n\n---\n\n".join(format_referral_block(rec, eta) for rec, eta in zip(stats, etas))
+    )
+    
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("⬅️", callback_data=f"admin_refs:page:{page - 1}"))
+    buttons.append(InlineKeyboardButton("🔄 Обновить заказы", callback_data=f"admin_refs:refresh:{page}"))
+    if page < pages - 1:
+        buttons.append(InlineKeyboardButton("➡️", callback_data=f"admin_refs:page:{page + 1}"))
+    keyboard = InlineKeyboardMarkup(row_width=3)
+    keyboard.row(*buttons)
+    
+    return text, keyboard
+
+
 @dp.message_handler(lambda message: message.text == "📋 Все рефералы", state="*")
 async def show_all_referrals(message: types.Message, state: FSMContext):
-    """Показать всех рефералов с актуальными заказами и пригласившим"""
-    if not db.is_admin(message.from_user.id):
+    """Показать всех рефералов с пригласившими (постранично, заказы из БД)"""
+    if not await db.is_admin(message.from_user.id):
         return
     
-    await message.answer("🔄 Загружаю актуальные данные по рефералам...")
-    
     try:
-        stats = db.get_referral_stats()
-        if not stats:
-            await message.answer("ℹ️ Рефералов пока нет.", reply_markup=get_admin_keyboard())
-            return
-        
-        blocks = []
-        for rec in stats:
-            # Получаем пользователей
-            referred = db.get_user(rec.get("referred_user_id"))
-            referrer = db.get_user(rec.get("referrer_user_id"))
-            
-            # Актуальное количество заказов для реферала
-            orders = await fetch_orders_live(referred)
-            
-            # Позиции
-            pos_referred = format_position_line(referred)
-            pos_referrer = format_position_line(referrer)
-            
-            # Телефоны
-            phone_referred = referred.get("phone_number") if referred else "не указан"
-            phone_referrer = referrer.get("phone_number") if referrer else "не указан"
-            
-            # Username links
-            def uname_link(u):
-                if u and u.get("username"):
-                    return f"@{u.get('username')}"
-                if u and u.get("user_id"):
-                    return f'<a href="tg://user?id={u.get("user_id")}">профиль</a>'
-                return "нет username"
-            
-            block = "\n".join([
-                pos_referred,
-                f"👤 Имя в Telegram: {referred.get('full_name') if referred else 'Не указано'}",
-                f"📱 Username: {uname_link(referred)}",
-                f"📞 Телефон: {phone_referred}",
-                f"📈 Заказов: {orders}",
-                "",
-                "👥 Пользователя пригласил:",
-                pos_referrer,
-                f"👤 Имя в Telegram: {referrer.get('full_name') if referrer else 'Не указано'}",
-                f"📱 Username: {uname_link(referrer)}",
-                f"📞 Телефон: {phone_referrer}",
-            ])
-            blocks.append(block)
-        
-        text = "📋 <b>Все рефералы</b>\n\n" + "\n\n---\n\n".join(blocks)
-        await message.answer(text, parse_mode="HTML", reply_markup=get_admin_keyboard())
+        text, keyboard = await build_referrals_page(0)
+        await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
     except Exception as e:
         logging.error(f"[ADMIN_REFERRALS] Ошибка при показе списка: {e}", exc_info=True)
         await message.answer("❌ Ошибка при загрузке рефералов.", reply_markup=get_admin_keyboard())
 
 
+@dp.callback_query_handler(lambda c: c.data.startswith("admin_refs:"), state="*")
+async def navigate_all_referrals(callback_query: types.CallbackQuery, state: FSMContext):
+    """Переход по страницам "📋 Все рефералы" и обновление заказов на текущей странице"""
+    if not await db.is_admin(callback_query.from_user.id):
+        await callback_query.answer("У вас нет прав администратора")
+        return
+    
+    _, action, page = callback_query.data.split(":")
+    refresh = action == "refresh"
+    await callback_query.answer("🔄 Обновляю заказы..." if refresh else None)
+    
+    try:
+        text, keyboard = await build_referrals_page(int(page), refresh=refresh)
+        await callback_query.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+    except Exception as e:
+        logging.warning(f"[ADMIN_REFERRALS] Не удалось обновить страницу {page}: {e}")
+
+
 @dp.message_handler(lambda message: message.text == "📈 Статистика", state="*")
 async def show_statistics(message: types.Message, state: FSMContext):
     """Показать статистику"""
     user_id = message.from_user.id
     
-    if not db.is_admin(user_id):
+    if not await db.is_admin(user_id):
         await message.answer("У вас нет прав администратора")
         return
     
-    users = db.get_all_users()
-    
-    # Подсчитываем статистику
-    total_users = len(users)
-    registered_in_park = sum(1 for u in users if u.get('is_registered_in_park'))
-    not_registered = total_users - registered_in_park
-    
-    # Статистика по категориям (только для не зарегистрированных в парке)
-    categories = {}
-    referrals_count = 0
-    
-    for user in users:
-        if not user.get('is_registered_in_park'):
-            category = user.get('category', 'unknown')
-            categories[category] = categories.get(category, 0) + 1
-        
-        if user.get('referrer_id'):
-            referrals_count += 1
+    stats = await db.get_statistics(ORDERS_THRESHOLD)
+    categories = stats["by_category"]
     
     stats_text = (
         f"📈 <b>Общая статистика</b>\n\n"
-        f"👥 <b>Всего пользователей:</b> {total_users}\n"
-        f"✅ <b>Зарегистрированы в парке:</b> {registered_in_park}\n"
-        f"📝 <b>В процессе регистрации:</b> {not_registered}\n"
-        f"🔗 <b>По реферальным ссылкам:</b> {referrals_count}\n\n"
+        f"👥 <b>Всего пользователей:</b> {stats['total_users']}\n"
+        f"✅ <b>Зарегистрированы в парке:</b> {stats['registered_in_park']}\n"
+        f"📝 <b>В процессе регистрации:</b> {stats['not_registered']}\n"
+        f"🔗 <b>По реферальным ссылкам:</b> {stats['referred_users']}\n\n"
     )
     
+    # Статистика по категориям (только для не зарегистрированных в парке)
     if categories:
         stats_text += f"📊 <b>По категориям (в процессе):</b>\n"
         for category, count in categories.items():
@@ -925,12 +1087,12 @@ async def show_statistics(message: types.Message, state: FSMContext):
             stats_text += f"{emoji} {name}: {count}\n"
     
     # Статистика рефералов
-    total_referrals = 0
-    for user in users:
-        refs = db.get_referrals(user['user_id'])
-        total_referrals += len(refs)
-    
-    stats_text += f"\n👥 <b>Всего приглашено:</b> {total_referrals}"
+    goal_reached = stats["goal_reached"]
+    stats_text += (
+        f"\n👥 <b>Всего приглашено:</b> {stats['total_referrals']}\n"
+        f"🎯 <b>Выполнили условие:</b> грузовой - {goal_reached.get('cargo', 0)}, "
+        f"экспресс - {goal_reached.get('express', 0)}"
+    )
     
     await message.answer(stats_text, parse_mode="HTML")
 
@@ -939,7 +1101,7 @@ async def show_statistics(message: types.Message, state: FSMContext):
 async def go_back(message: types.Message, state: FSMContext):
     """Вернуться в главное меню"""
     user_id = message.from_user.id
-    is_admin = db.is_admin(user_id)
+    is_admin = await db.is_admin(user_id)
     
     await message.answer(
         "Главное меню",
@@ -947,15 +1109,80 @@ async def go_back(message: types.Message, state: FSMContext):
     )
 
 
+async def sweep_user_data():
+    """Периодически удаляет устаревшие данные регистрации из user_data и пишет метрики вытеснения"""
+    last_evictions = 0
+    while True:
+        await asyncio.sleep(USER_DATA_SWEEP_INTERVAL)
+        expired = user_data.expire()
+        evicted = user_data.evictions - last_evictions
+        last_evictions = user_data.evictions
+        if expired or evicted:
+            logging.info(
+                f"user_data: записей {len(user_data)}, удалено по времени простоя {expired} "
+                f"(всего {user_data.expirations}), вытеснено при переполнении {evicted} (всего {user_data.evictions})"
+            )
+
+
+async def run_polling():
+    """
+    Long polling до SIGINT/SIGTERM. По сигналу опрос прерывается сразу (не дожидаясь
+    текущего getUpdates), и main() успевает сохранить состояния FSM и закрыть ресурсы
+    """
+    polling = asyncio.create_task(dp.start_polling())
+    loop = asyncio.get_running_loop()
+    
+    def stop():
+        logging.info("Остановка бота...")
+        dp.stop_polling()
+        polling.cancel()
+    
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop)
+    try:
+        await asyncio.wait({polling})
+    finally:
+        polling.cancel()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
+    if not polling.cancelled() and polling.exception() is not None:
+        raise polling.exception()
+
+
 async def main():
     """Запуск бота"""
     logging.info("Запуск бота...")
+    if BOT_MODE == "webhook":
+        # Без корректного адреса set_webhook снял бы webhook и бот молча перестал бы получать обновления
+        try:
+            check_webhook_url(WEBHOOK_URL)
+        except ValueError as e:
+            logging.error(f"Режим webhook не может быть запущен: {e}")
+            raise SystemExit(1)
+    sweeper = asyncio.create_task(sweep_user_data())
     
     try:
-        await bot.delete_webhook(drop_pending_updates=True)
-        await dp.start_polling()
+        await yandex_api.start()
+        # Прогреваем справочник водителей, чтобы первая регистрация не ждала выгрузку
+        yandex_api.schedule_roster_refresh()
+        if BOT_MODE == "webhook":
+            server = WebhookServer(dp, urlsplit(WEBHOOK_URL).path or "/webhook", WEBHOOK_SECRET or None)
+            await server.run(WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_URL)
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await run_polling()
     except Exception as e:
         logging.error(f"Ошибка при запуске бота: {e}")
+    finally:
+        sweeper.cancel()
+        # Фоновые обновления профиля используют БД и API - завершаем их до закрытия
+        await stop_profile_refreshes()
+        # Закрываем пул соединений к Яндекс Парку, соединение с БД и хранилище состояний FSM
+        await yandex_api.close()
+        await db.close()
+        await dp.storage.close()
+        await dp.storage.wait_closed()
+        await (await bot.get_session()).close()
 
 
 if __name__ == "__main__":
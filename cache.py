@@ -0,0 +1,128 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    LRU-кэш с ограничением размера и временем жизни записей.
+    
+    При переполнении вытесняется запись, которую дольше всех не читали.
+    Запись старше ttl считается отсутствующей; при чтении можно дополнительно
+    ограничить допустимый возраст параметром max_age. При sliding=True успешное чтение
+    продлевает жизнь записи (ttl отсчитывается от последнего обращения, а не от записи).
+    Можно использовать из нескольких потоков.
+    
+    invalidate() и clear() увеличивают поколение кэша. Поток, который читает значение из
+    источника, берёт generation() до чтения и передаёт его в set(): если за это время кэш
+    сбросили, прочитанное значение могло устареть и не сохраняется.
+    """
+    
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0, sliding: bool = False):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sliding = sliding
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (value, stored_at)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # Вытеснено из-за переполнения
+        self.expirations = 0  # Удалено по истечении ttl
+        self._generation = 0  # Растёт при каждом invalidate() и clear()
+        self._lock = threading.Lock()
+    
+    def get(self, key: Hashable, default: Any = None, max_age: Optional[float] = None) -> Any:
+        """
+        Возвращает значение, если оно есть и не старше min(ttl, max_age) секунд
+        
+        Args:
+            key: Ключ
+            default: Что вернуть при промахе
+            max_age: Допустимый возраст записи для этого вызова, секунд
+        """
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            
+            value, stored_at = item
+            now = time.monotonic()
+            age = now - stored_at
+            if age > self.ttl:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            if max_age is not None and age > max_age:
+                # Запись ещё жива, но слишком стара для этого вызова
+                self.misses += 1
+                return default
+            
+            if self.sliding:
+                self._data[key] = (value, now)
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def generation(self) -> int:
+        """Текущее поколение кэша (см. set)"""
+        with self._lock:
+            return self._generation
+    
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None) -> bool:
+        """
+        Сохраняет значение, вытесняя самые давно использованные записи при переполнении
+        
+        Args:
+            key: Ключ
+            value: Значение
+            generation: Результат generation() перед чтением value из источника; если с тех пор
+                кэш сбрасывали, значение не сохраняется
+        
+        Returns:
+            True, если значение сохранено
+        """
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return False
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+            return True
+    
+    def invalidate(self, key: Hashable):
+        """Удаляет запись, если она есть, и отменяет set() начатых до этого чтений"""
+        with self._lock:
+            self._data.pop(key, None)
+            self._generation += 1
+    
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Удаляет запись и возвращает её значение (default, если записи нет или она устарела)"""
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+            if item is _MISSING or time.monotonic() - item[1] > self.ttl:
+                return default
+            return item[0]
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._generation += 1
+    
+    def expire(self) -> int:
+        """Удаляет все записи старше ttl и возвращает их количество"""
+        with self._lock:
+            deadline = time.monotonic() - self.ttl
+            expired = [key for key, (_, stored_at) in self._data.items() if stored_at < deadline]
+            for key in expired:
+                del self._data[key]
+            self.expirations += len(expired)
+            return len(expired)
+    
+    def __len__(self) -> int:
+        return len(self._data)
@@ -15,6 +15,35 @@ YANDEX_PARK_ID = os.getenv("YANDEX_PARK_ID", "138738dbd66d49c88675ac0020ba7ca4")
 YANDEX_API_KEY = os.getenv("YANDEX_API_KEY", "QTkYBGXCHhLlCFOqlVMErQpwJEXzXDYMg")
 YANDEX_CLIENT_ID = os.getenv("YANDEX_CLIENT_ID", "taxi/park/138738dbd66d49c88675ac0020ba7ca4")
 
+# Лимит запросов к API Яндекс Парка в секунду (на каждый процесс: бот и order_checker).
+# Темп стартует с YANDEX_API_RPS, растёт до YANDEX_API_MAX_RPS и снижается при ответах 429
+YANDEX_API_RPS = float(os.getenv("YANDEX_API_RPS", "3"))
+YANDEX_API_MAX_RPS = float(os.getenv("YANDEX_API_MAX_RPS", "10"))
+
+# Сколько водителей order_checker проверяет параллельно
+ORDER_CHECK_WORKERS = int(os.getenv("ORDER_CHECK_WORKERS", "4"))
+
+# Раз во сколько дней order_checker перепроверяет инкрементальный счётчик заказов водителя
+# полным пересчётом истории (каждый пересчёт читает все заказы водителя за 5 лет)
+ORDERS_FULL_RESYNC_DAYS = int(os.getenv("ORDERS_FULL_RESYNC_DAYS", "30"))
+
+# Способ получения обновлений от Telegram: "polling" (по умолчанию) или "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+
+# Для режима webhook: публичный HTTPS-адрес, на который Telegram присылает обновления
+# (например: https://example.com/webhook), адрес локального веб-сервера за reverse proxy
+# и секрет, который Telegram передаёт в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "127.0.0.1")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+# Сколько заказов должен выполнить реферал по позиции в парке для бонуса рефереру
+ORDERS_THRESHOLD = {
+    "cargo": 30,  # Грузовой - 30 заказов
+    "express": 45  # Экспресс - 45 заказов
+}
+
 # Список администраторов (будут всегда иметь права админа)
 ADMIN_USER_IDS = [
     6933111964,
@@ -1,86 +1,258 @@
 import sqlite3
 from datetime import datetime
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple
 import logging
+from rows import row_type, row_factory
+from cache import TTLCache
+
+_MISSING = object()
+
+# Типы строк результатов запросов (поля - в порядке колонок SELECT)
+UserRow = row_type("UserRow", """
+    user_id username full_name phone_number category referrer_id created_at
+    is_admin is_registered_in_park yandex_driver_id yandex_driver_name park_position
+""")
+UserListRow = row_type("UserListRow", """
+    user_id username full_name category referrer_id created_at phone_number is_registered_in_park
+""")
+OrderCheckRow = row_type("OrderCheckRow", """
+    referrer_id referred_id yandex_driver_id park_position orders_count notification_sent
+""")
+ReferralRow = row_type("ReferralRow", """
+    user_id full_name username category orders_count bonus_paid created_at
+    orders_updated_at is_registered_in_park yandex_driver_id
+""")
+ReferralStatsRow = row_type("ReferralStatsRow", """
+    referrer_user_id referrer_full_name referrer_username referrer_phone_number
+    referrer_category referrer_park_position
+    referred_user_id referred_full_name referred_username referred_phone_number
+    referred_category referred_park_position referred_is_registered_in_park referred_yandex_driver_id
+    orders_count orders_updated_at
+""")
+InvitedUserRow = row_type("InvitedUserRow", "full_name username phone_number orders_count")
+WatermarkRow = row_type("WatermarkRow", "last_ended_at orders_count full_sync_at checked_at")
+DriverPositionRow = row_type("DriverPositionRow", "yandex_driver_id park_position car_brand car_model cargo_type updated_at")
+
+# Вторичные индексы под запросы Database (создаются миграцией 1)
+INDEXES = {
+    # get_user_by_phone
+    "idx_users_phone": "CREATE INDEX IF NOT EXISTS idx_users_phone ON users(phone_number)",
+    # get_user_by_driver_id, перенос позиции водителя в save_check_results
+    "idx_users_driver": "CREATE INDEX IF NOT EXISTS idx_users_driver ON users(yandex_driver_id)",
+    # Выборка водителей парка для проверки заказов (частичный покрывающий индекс, user_id = rowid)
+    "idx_users_park_drivers": """
+        CREATE INDEX IF NOT EXISTS idx_users_park_drivers
+        ON users(yandex_driver_id, park_position)
+        WHERE is_registered_in_park = 1 AND yandex_driver_id IS NOT NULL AND yandex_driver_id != ''
+    """,
+    # get_all_users (ORDER BY created_at DESC)
+    "idx_users_created": "CREATE INDEX IF NOT EXISTS idx_users_created ON users(created_at)",
+    # Поиск реферала по referred_id (update_orders_count, get_user_orders_count, get_referrer_id);
+    # поиск по referrer_id покрывает UNIQUE(referrer_id, referred_id)
+    "idx_referrals_referred": "CREATE INDEX IF NOT EXISTS idx_referrals_referred ON referrals(referred_id)",
+    "idx_orders_log_user": "CREATE INDEX IF NOT EXISTS idx_orders_log_user ON orders_log(user_id, updated_at)",
+    # get_stale_driver_positions
+    "idx_driver_positions_updated": "CREATE INDEX IF NOT EXISTS idx_driver_positions_updated ON driver_positions(updated_at)",
+}
+
+
+# Запись отметки подсчёта заказов: (yandex_driver_id, last_ended_at, orders_count, full_sync)
+_UPSERT_ORDER_WATERMARK = """
+INSERT INTO order_watermarks (yandex_driver_id, last_ended_at, orders_count, full_sync_at, updated_at)
+VALUES (?, ?, ?, CASE WHEN ? THEN CURRENT_TIMESTAMP END, CURRENT_TIMESTAMP)
+ON CONFLICT(yandex_driver_id) DO UPDATE SET
+    last_ended_at = excluded.last_ended_at,
+    orders_count = excluded.orders_count,
+    full_sync_at = COALESCE(excluded.full_sync_at, order_watermarks.full_sync_at),
+    updated_at = CURRENT_TIMESTAMP
+"""
+
+# Запись позиции водителя: (yandex_driver_id, park_position, car_brand, car_model, cargo_type)
+_UPSERT_DRIVER_POSITION = """
+INSERT INTO driver_positions (yandex_driver_id, park_position, car_brand, car_model, cargo_type, updated_at)
+VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+ON CONFLICT(yandex_driver_id) DO UPDATE SET
+    park_position = excluded.park_position,
+    car_brand = excluded.car_brand,
+    car_model = excluded.car_model,
+    cargo_type = excluded.cargo_type,
+    updated_at = CURRENT_TIMESTAMP
+"""
+
+
+def _driver_position_params(yandex_driver_id: str, park_position: str, car: Dict) -> tuple:
+    return (yandex_driver_id, park_position, car.get("brand"), car.get("model"), car.get("cargo_type"))
+
+
+def _add_column(cursor, table: str, column: str, definition: str):
+    """Добавляет колонку, если её ещё нет"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in (row[1] for row in cursor.fetchall()):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def _migration_1_initial_schema(cursor):
+    """Исходная схема: таблицы, колонки, добавленные позже (для старых БД), и индексы"""
+    # Таблица пользователей
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        full_name TEXT,
+        first_name TEXT,
+        phone_number TEXT,
+        category TEXT,
+        referrer_id INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        is_admin INTEGER DEFAULT 0,
+        is_registered_in_park INTEGER DEFAULT 0,
+        yandex_driver_id TEXT,
+        yandex_driver_name TEXT,
+        park_position TEXT
+    )
+    """)
+    
+    # Колонки, которых нет в БД, созданных старыми версиями бота
+    _add_column(cursor, "users", "park_position", "TEXT")
+    
+    # Таблица рефералов
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS referrals (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        referrer_id INTEGER,
+        referred_id INTEGER,
+        orders_count INTEGER DEFAULT 0,
+        bonus_paid INTEGER DEFAULT 0,
+        park_position TEXT,
+        notification_sent INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(referrer_id, referred_id),
+        FOREIGN KEY (referrer_id) REFERENCES users(user_id),
+        FOREIGN KEY (referred_id) REFERENCES users(user_id)
+    )
+    """)
+    
+    _add_column(cursor, "referrals", "park_position", "TEXT")
+    _add_column(cursor, "referrals", "notification_sent", "INTEGER DEFAULT 0")
+    
+    # Таблица для отслеживания заказов
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS orders_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        order_count INTEGER,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    )
+    """)
+    
+    # Отметки инкрементального подсчёта заказов по водителям
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS order_watermarks (
+        yandex_driver_id TEXT PRIMARY KEY,
+        last_ended_at TEXT,
+        orders_count INTEGER DEFAULT 0,
+        full_sync_at TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    
+    # Таблица позиций водителей: результат классификации и автомобиль, по которому она сделана
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS driver_positions (
+        yandex_driver_id TEXT PRIMARY KEY,
+        park_position TEXT NOT NULL,
+        car_brand TEXT,
+        car_model TEXT,
+        cargo_type TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    
+    for sql in INDEXES.values():
+        cursor.execute(sql)
+
+
+
+def _migration_2_orders_updated_at(cursor):
+    """Время последнего обновления количества заказов реферала (показывается в профиле)"""
+    _add_column(cursor, "referrals", "orders_updated_at", "TIMESTAMP")
+
+
+# Миграции схемы по порядку: после i-й миграции PRAGMA user_version = i.
+# Применённые миграции не меняются - изменения схемы добавляются новыми миграциями в конец
+MIGRATIONS = [
+    _migration_1_initial_schema,
+    _migration_2_orders_updated_at,
+]
+
 
 class Database:
-    def __init__(self, db_file: str = "bot.db"):
+    # Ожидание блокировки файла другим процессом (бот и проверка заказов пишут в одну БД), мс
+    BUSY_TIMEOUT_MS = 5000
+    # Размер кэша страниц SQLite, КиБ
+    PAGE_CACHE_KIB = 16384
+    # Кэш строк пользователей (get_user, is_admin). Записи этого процесса сбрасывают кэш сразу,
+    # изменения из другого процесса (order_checker, set_admin.py) становятся видны не позже чем через TTL:
+    # администратор, снятый через set_admin.py, остаётся админом в запущенном боте до USER_CACHE_TTL секунд
+    USER_CACHE_SIZE = 10000
+    USER_CACHE_TTL = 60
+    # История заказов (orders_log): точки моложе ORDERS_LOG_RAW_DAYS хранятся все,
+    # старше - последняя за день, старше ORDERS_LOG_KEEP_DAYS удаляются (кроме последней точки пользователя)
+    ORDERS_LOG_RAW_DAYS = 30
+    ORDERS_LOG_KEEP_DAYS = 365
+    # Меньший промежуток истории не даёт осмысленной скорости, суток
+    MIN_VELOCITY_SPAN_DAYS = 1 / 24
+    
+    def __init__(self, db_file: str = "bot.db", read_only: bool = False, user_cache: Optional[TTLCache] = None):
         self.db_file = db_file
-        self.init_db()
+        # Несколько объектов Database над одной БД (AsyncDatabase) должны делить один кэш
+        self.user_cache = user_cache if user_cache is not None else TTLCache(self.USER_CACHE_SIZE, self.USER_CACHE_TTL)
+        # Одно соединение на всё время жизни объекта вместо нового на каждый запрос
+        self.conn = self.get_connection()
+        if read_only:
+            # Соединение только для чтения (читатели AsyncDatabase): схему создаёт писатель
+            self.conn.execute("PRAGMA query_only=ON")
+        else:
+            self.init_db()
     
     def get_connection(self):
-        return sqlite3.connect(self.db_file)
+        """Новое соединение с БД с настройками WAL (для разовых скриптов - закрывать самостоятельно)"""
+        # Соединение может быть создано и закрыто в разных потоках (см. AsyncDatabase),
+        # но одновременно им пользуется только один поток
+        conn = sqlite3.connect(self.db_file, timeout=self.BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        # WAL: читатели не ждут писателя, а писатель - читателей
+        conn.execute("PRAGMA journal_mode=WAL")
+        # В режиме WAL NORMAL не теряет целостность, но не делает fsync на каждый коммит
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{self.PAGE_CACHE_KIB}")
+        conn.execute(f"PRAGMA busy_timeout={self.BUSY_TIMEOUT_MS}")
+        return conn
+    
+    def close(self):
+        """Закрытие соединения с БД"""
+        self.conn.close()
     
     def init_db(self):
-        """Инициализация базы данных"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Таблица пользователей
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            full_name TEXT,
-            first_name TEXT,
-            phone_number TEXT,
-            category TEXT,
-            referrer_id INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            is_admin INTEGER DEFAULT 0,
-            is_registered_in_park INTEGER DEFAULT 0,
-            yandex_driver_id TEXT,
-            yandex_driver_name TEXT,
-            park_position TEXT
-        )
-        """)
-        
-        # Добавляем колонку park_position, если её нет
-        try:
-            cursor.execute("ALTER TABLE users ADD COLUMN park_position TEXT")
-        except sqlite3.OperationalError:
-            pass  # Колонка уже существует
-        
-        # Таблица рефералов
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS referrals (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            referrer_id INTEGER,
-            referred_id INTEGER,
-            orders_count INTEGER DEFAULT 0,
-            bonus_paid INTEGER DEFAULT 0,
-            park_position TEXT,
-            notification_sent INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(referrer_id, referred_id),
-            FOREIGN KEY (referrer_id) REFERENCES users(user_id),
-            FOREIGN KEY (referred_id) REFERENCES users(user_id)
-        )
-        """)
+        """Применение новых миграций схемы (номер последней применённой - PRAGMA user_version)"""
+        conn = self.conn
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= len(MIGRATIONS):
+            return
         
-        # Добавляем колонки park_position и notification_sent, если их нет
-        try:
-            cursor.execute("ALTER TABLE referrals ADD COLUMN park_position TEXT")
-        except sqlite3.OperationalError:
-            pass
+        cursor = conn.cursor()
         try:
-            cursor.execute("ALTER TABLE referrals ADD COLUMN notification_sent INTEGER DEFAULT 0")
-        except sqlite3.OperationalError:
-            pass
-        
-        # Таблица для отслеживания заказов
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS orders_log (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            order_count INTEGER,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(user_id)
-        )
-        """)
-        
-        conn.commit()
-        conn.close()
+            # Блокировка на запись: второй процесс дождётся окончания миграций и не повторит их
+            cursor.execute("BEGIN IMMEDIATE")
+            version = cursor.execute("PRAGMA user_version").fetchone()[0]
+            for number in range(version + 1, len(MIGRATIONS) + 1):
+                MIGRATIONS[number - 1](cursor)
+                cursor.execute(f"PRAGMA user_version = {number}")
+                logging.info(f"Применена миграция БД {number}: {MIGRATIONS[number - 1].__name__}")
+            cursor.execute("ANALYZE")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
     
     def add_user(self, user_id: int, username: str, full_name: str, 
                  first_name: str, phone_number: str, category: str = None, 
@@ -88,7 +260,7 @@ class Database:
                  yandex_driver_id: str = None, yandex_driver_name: str = None,
                  park_position: str = None):
         """Добавление нового пользователя"""
-        conn = self.get_connection()
+        conn = self.conn
         cursor = conn.cursor()
         
         try:
@@ -112,17 +284,28 @@ class Database:
                 logging.info(f"Реферал не добавлен (пользователь уже в парке): referrer_id={referrer_id}, referred_id={user_id}")
             
             conn.commit()
+            self.user_cache.invalidate(user_id)
             return True
         except Exception as e:
+            conn.rollback()
             logging.error(f"Ошибка при добавлении пользователя: {e}")
             return False
-        finally:
-            conn.close()
     
-    def get_user(self, user_id: int) -> Optional[Dict]:
-        """Получение информации о пользователе"""
-        conn = self.get_connection()
+    def get_user(self, user_id: int) -> Optional[UserRow]:
+        """
+        Получение информации о пользователе (через кэш; отсутствие пользователя тоже кэшируется).
+        Возвращает копию закэшированной строки: изменение её вызывающим не затронет других читателей
+        """
+        user = self.user_cache.get(user_id, _MISSING)
+        if user is not _MISSING:
+            return user.copy() if user is not None else None
+        
+        # Поколение берём до SELECT: если писатель закоммитит и сбросит кэш, пока идёт чтение,
+        # прочитанная (возможно, старая) строка в кэш не попадёт
+        generation = self.user_cache.generation()
+        conn = self.conn
         cursor = conn.cursor()
+        cursor.row_factory = row_factory(UserRow)
         
         cursor.execute("""
         SELECT user_id, username, full_name, phone_number, category, referrer_id, 
@@ -130,30 +313,15 @@ class Database:
         FROM users WHERE user_id = ?
         """, (user_id,))
         
-        row = cursor.fetchone()
-        conn.close()
-        
-        if row:
-            return {
-                "user_id": row[0],
-                "username": row[1],
-                "full_name": row[2],
-                "phone_number": row[3],
-                "category": row[4],
-                "referrer_id": row[5],
-                "created_at": row[6],
-                "is_admin": row[7],
-                "is_registered_in_park": row[8],
-                "yandex_driver_id": row[9],
-                "yandex_driver_name": row[10],
-                "park_position": row[11]
-            }
-        return None
+        user = cursor.fetchone()
+        self.user_cache.set(user_id, user, generation)
+        return user.copy() if user is not None else None
     
-    def get_user_by_phone(self, phone_number: str) -> Optional[Dict]:
+    def get_user_by_phone(self, phone_number: str) -> Optional[UserRow]:
         """Получение информации о пользователе по номеру телефона"""
-        conn = self.get_connection()
+        conn = self.conn
         cursor = conn.cursor()
+        cursor.row_factory = row_factory(UserRow)
         
         cursor.execute("""
         SELECT user_id, username, full_name, phone_number, category, referrer_id, 
@@ -161,29 +329,11 @@ class Database:
         FROM users WHERE phone_number = ?
         """, (phone_number,))
         
-        row = cursor.fetchone()
-        conn.close()
-        
-        if row:
-            return {
-                "user_id": row[0],
-                "username": row[1],
-                "full_name": row[2],
-                "phone_number": row[3],
-                "category": row[4],
-                "referrer_id": row[5],
-                "created_at": row[6],
-                "is_admin": row[7],
-                "is_registered_in_park": row[8],
-                "yandex_driver_id": row[9],
-                "yandex_driver_name": row[10],
-                "park_position": row[11]
-            }
-        return None
+        return cursor.fetchone()
     
     def get_user_by_driver_id(self, yandex_driver_id: str) -> Optional[Dict]:
         """Получение информации о пользователе по yandex_driver_id"""
-        conn = self.get_connection()
+        conn = self.conn
         cursor = conn.cursor()
         
         cursor.execute("""
@@ -191,123 +341,120 @@ class Database:
         """, (yandex_driver_id,))
         
         row = cursor.fetchone()
-        conn.close()
         
         if row:
             return {"user_id": row[0]}
         return None
     
-    def get_referrals_for_order_check(self) -> List[Dict]:
+    def get_referrals_for_order_check(self) -> List[OrderCheckRow]:
         """Получение списка рефералов, зарегистрированных в парке, для проверки заказов"""
-        conn = self.get_connection()
+        conn = self.conn
         cursor = conn.cursor()
+        cursor.row_factory = row_factory(OrderCheckRow)
         
         # Получаем всех пользователей, зарегистрированных в парке, которые есть в referrals
         cursor.execute("""
         SELECT r.referrer_id, r.referred_id, u.yandex_driver_id, 
                COALESCE(r.park_position, u.park_position) as park_position, 
-               r.orders_count, r.notification_sent
+               COALESCE(r.orders_count, 0), COALESCE(r.notification_sent, 0)
         FROM referrals r
         JOIN users u ON r.referred_id = u.user_id
         WHERE u.is_registered_in_park = 1 AND u.yandex_driver_id IS NOT NULL AND u.yandex_driver_id != ''
         """)
         
-        rows = cursor.fetchall()
-        conn.close()
-        
-        return [
-            {
-                "referrer_id": row[0],
-                "referred_id": row[1],
-                "yandex_driver_id": row[2],
-                "park_position": row[3],
-                "orders_count": row[4] or 0,
-                "notification_sent": row[5] or 0
-            }
-            for row in rows
-        ]
-    
-    def get_all_park_users_for_order_check(self) -> List[Dict]:
-        """Получение всех пользователей, зарегистрированных в парке, для проверки заказов (не только рефералов)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        return cursor.fetchall()
+    
+    def get_all_park_users_for_order_check(self) -> List[OrderCheckRow]:
+        """
+        Все пользователи, зарегистрированные в парке, для проверки заказов (не только рефералы).
+        referrer_id - из referrals, если запись есть. Возвращается список: цикл проверки до запуска
+        воркеров всё равно собирает всех водителей (общий проход по заказам парка, счётчик прогресса)
+        """
+        cursor = self.conn.cursor()
+        cursor.row_factory = row_factory(OrderCheckRow)
         
-        # Получаем всех пользователей, зарегистрированных в парке
         cursor.execute("""
-        SELECT u.user_id, u.yandex_driver_id, u.park_position
+        SELECT MIN(r.referrer_id), u.user_id, u.yandex_driver_id, u.park_position, 0, 0
         FROM users u
+        LEFT JOIN referrals r ON r.referred_id = u.user_id
         WHERE u.is_registered_in_park = 1 AND u.yandex_driver_id IS NOT NULL AND u.yandex_driver_id != ''
+        GROUP BY u.user_id
         """)
         
-        rows = cursor.fetchall()
-        conn.close()
+        return cursor.fetchall()
+    
+    def add_referral(self, referrer_id: int, referred_id: int, park_position: str = None) -> bool:
+        """Добавление записи реферала (если её ещё нет)"""
+        conn = self.conn
+        cursor = conn.cursor()
         
-        result = []
-        for row in rows:
-            user_id = row[0]
-            yandex_driver_id = row[1]
-            park_position = row[2]
-            
-            # Получаем referrer_id из referrals, если есть
-            referrer_id = None
-            conn2 = self.get_connection()
-            cursor2 = conn2.cursor()
-            cursor2.execute("SELECT referrer_id FROM referrals WHERE referred_id = ? LIMIT 1", (user_id,))
-            ref_row = cursor2.fetchone()
-            if ref_row:
-                referrer_id = ref_row[0]
-            conn2.close()
-            
-            result.append({
-                "referrer_id": referrer_id,
-                "referred_id": user_id,
-                "yandex_driver_id": yandex_driver_id,
-                "park_position": park_position,
-                "orders_count": 0,
-                "notification_sent": 0
-            })
-        
-        return result
-    
-    def get_referrals(self, referrer_id: int) -> List[Dict]:
+        try:
+            cursor.execute("""
+            INSERT OR IGNORE INTO referrals (referrer_id, referred_id, park_position)
+            VALUES (?, ?, ?)
+            """, (referrer_id, referred_id, park_position))
+            conn.commit()
+            return True
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Ошибка при добавлении реферала: {e}")
+            return False
+    
+    def get_referrer_id(self, referred_id: int) -> Optional[int]:
+        """Получение referrer_id из referrals"""
+        conn = self.conn
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute("SELECT referrer_id FROM referrals WHERE referred_id = ? LIMIT 1", (referred_id,))
+            row = cursor.fetchone()
+            return row[0] if row and row[0] else None
+        except Exception as e:
+            logging.error(f"Ошибка при поиске referrer_id в referrals: {e}")
+            return None
+    
+    def update_user_category(self, user_id: int, category: str) -> bool:
+        """Обновление категории пользователя"""
+        conn = self.conn
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute("UPDATE users SET category = ? WHERE user_id = ?", (category, user_id))
+            conn.commit()
+            self.user_cache.invalidate(user_id)
+            return True
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Ошибка при обновлении категории пользователя {user_id}: {e}")
+            return False
+    
+    def get_referrals(self, referrer_id: int) -> List[ReferralRow]:
         """Получение списка приглашённых пользователей"""
-        conn = self.get_connection()
+        conn = self.conn
         cursor = conn.cursor()
+        cursor.row_factory = row_factory(ReferralRow)
         
         cursor.execute("""
-        SELECT u.user_id, u.full_name, u.username, u.category, r.orders_count, r.bonus_paid, r.created_at
+        SELECT u.user_id, u.full_name, u.username, u.category, r.orders_count, r.bonus_paid, r.created_at,
+               r.orders_updated_at, u.is_registered_in_park, u.yandex_driver_id
         FROM referrals r
         JOIN users u ON r.referred_id = u.user_id
         WHERE r.referrer_id = ?
         ORDER BY r.created_at DESC
         """, (referrer_id,))
         
-        rows = cursor.fetchall()
-        conn.close()
-        
-        return [
-            {
-                "user_id": row[0],
-                "full_name": row[1],
-                "username": row[2],
-                "category": row[3],
-                "orders_count": row[4],
-                "bonus_paid": row[5],
-                "created_at": row[6]
-            }
-            for row in rows
-        ]
+        return cursor.fetchall()
     
     def update_orders_count(self, user_id: int, orders_count: int) -> bool:
         """Обновление количества заказов для пользователя"""
-        conn = self.get_connection()
+        conn = self.conn
         cursor = conn.cursor()
         
         try:
             # Сначала пытаемся обновить существующую запись
             cursor.execute("""
             UPDATE referrals
-            SET orders_count = ?
+            SET orders_count = ?, orders_updated_at = CURRENT_TIMESTAMP
             WHERE referred_id = ?
             """, (orders_count, user_id))
             
@@ -332,8 +479,8 @@ class Database:
                     
                     # Создаем запись в referrals
                     cursor.execute("""
-                    INSERT OR REPLACE INTO referrals (referrer_id, referred_id, orders_count, park_position)
-                    VALUES (?, ?, ?, ?)
+                    INSERT OR REPLACE INTO referrals (referrer_id, referred_id, orders_count, park_position, orders_updated_at)
+                    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
                     """, (referrer_id, user_id, orders_count, park_position))
                     rows_affected = cursor.rowcount
                     logging.info(f"Created referral record for user {user_id} with orders_count {orders_count}")
@@ -350,12 +497,96 @@ class Database:
             logging.error(f"Ошибка при обновлении заказов для user_id {user_id}: {e}", exc_info=True)
             conn.rollback()
             return False
-        finally:
-            conn.close()
+    
+    def save_check_results(self, results: List[Tuple[int, Optional[int], Optional[str]]],
+                           notified: List[Tuple[int, int]] = (),
+                           watermarks: List[Tuple[str, str, int, bool]] = (),
+                           driver_positions: List[Tuple[str, str, Dict]] = ()) -> bool:
+        """
+        Сохранение результатов проверки водителей одной транзакцией
+        
+        Args:
+            results: (user_id, orders_count, park_position); None - значение не изменилось
+            notified: (referrer_id, referred_id), по которым отправлено уведомление о цели
+            watermarks: отметки подсчёта заказов (yandex_driver_id, last_ended_at, orders_count, full_sync)
+            driver_positions: позиции водителей, определённые по автомобилю (yandex_driver_id, park_position, car);
+                позиция переносится всем пользователям водителя
+        """
+        conn = self.conn
+        cursor = conn.cursor()
+        
+        positions = [(park_position, user_id) for user_id, _, park_position in results if park_position]
+        counts = [(orders_count, user_id) for user_id, orders_count, _ in results if orders_count is not None]
+        by_driver = [(park_position, driver_id) for driver_id, park_position, _ in driver_positions]
+        
+        try:
+            # Позиция - и в users, и в referrals (как update_user_park_position)
+            cursor.executemany("UPDATE users SET park_position = ? WHERE user_id = ?", positions)
+            cursor.executemany("UPDATE referrals SET park_position = ? WHERE referred_id = ?", positions)
+            
+            # Позиции водителей и перенос изменившихся на их пользователей
+            cursor.executemany(_UPSERT_DRIVER_POSITION, [
+                _driver_position_params(driver_id, park_position, car)
+                for driver_id, park_position, car in driver_positions
+            ])
+            cursor.executemany("""
+            UPDATE users SET park_position = ?1 WHERE yandex_driver_id = ?2 AND park_position IS NOT ?1
+            """, by_driver)
+            moved_users = cursor.rowcount
+            cursor.executemany("""
+            UPDATE referrals SET park_position = ?1
+            WHERE referred_id IN (SELECT user_id FROM users WHERE yandex_driver_id = ?2)
+              AND park_position IS NOT ?1
+            """, by_driver)
+            
+            cursor.executemany(_UPSERT_ORDER_WATERMARK, [
+                (driver_id, last_ended_at, orders_count, 1 if full_sync else 0)
+                for driver_id, last_ended_at, orders_count, full_sync in watermarks
+            ])
+            
+            # Количество заказов (как update_orders_count): обновляем запись реферала,
+            # а если её нет - создаём по referrer_id из users
+            cursor.executemany("""
+            UPDATE referrals SET orders_count = ?, orders_updated_at = CURRENT_TIMESTAMP WHERE referred_id = ?
+            """, counts)
+            cursor.executemany("""
+            INSERT INTO referrals (referrer_id, referred_id, orders_count, park_position, orders_updated_at)
+            SELECT u.referrer_id, u.user_id, ?, u.park_position, CURRENT_TIMESTAMP
+            FROM users u
+            WHERE u.user_id = ? AND u.referrer_id IS NOT NULL
+              AND NOT EXISTS (SELECT 1 FROM referrals r WHERE r.referred_id = u.user_id)
+            """, counts)
+            
+            # История заказов: новая точка, только если количество изменилось с последней
+            cursor.executemany("""
+            INSERT INTO orders_log (user_id, order_count)
+            SELECT ?2, ?1
+            WHERE ?1 IS NOT (
+                SELECT order_count FROM orders_log WHERE user_id = ?2
+                ORDER BY updated_at DESC, id DESC LIMIT 1
+            )
+            """, counts)
+            
+            cursor.executemany("""
+            UPDATE referrals SET notification_sent = 1
+            WHERE referrer_id = ? AND referred_id = ?
+            """, notified)
+            
+            conn.commit()
+            for _, user_id in positions:
+                self.user_cache.invalidate(user_id)
+            if moved_users > 0:
+                # Пользователей водителя по кэшу не найти - позиция меняется редко, сбрасываем весь
+                self.user_cache.clear()
+            return True
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Ошибка при сохранении результатов проверки ({len(results)} записей): {e}", exc_info=True)
+            return False
     
     def get_user_orders_count(self, user_id: int) -> int:
         """Получение количества заказов пользователя"""
-        conn = self.get_connection()
+        conn = self.conn
         cursor = conn.cursor()
         
         try:
@@ -367,12 +598,10 @@ class Database:
         except Exception as e:
             logging.error(f"Ошибка при получении количества заказов для user_id {user_id}: {e}")
             return 0
-        finally:
-            conn.close()
     
     def update_user_park_position(self, user_id: int, park_position: str) -> bool:
         """Обновление позиции пользователя в парке"""
-        conn = self.get_connection()
+        conn = self.conn
         cursor = conn.cursor()
         
         try:
@@ -390,17 +619,17 @@ class Database:
             """, (park_position, user_id))
             
             conn.commit()
+            self.user_cache.invalidate(user_id)
             logging.info(f"Updated park_position for user {user_id} to {park_position}")
             return True
         except Exception as e:
+            conn.rollback()
             logging.error(f"Ошибка при обновлении позиции: {e}")
             return False
-        finally:
-            conn.close()
     
     def mark_notification_sent(self, referrer_id: int, referred_id: int) -> bool:
         """Отметить, что уведомление о достижении цели отправлено"""
-        conn = self.get_connection()
+        conn = self.conn
         cursor = conn.cursor()
         
         try:
@@ -413,14 +642,13 @@ class Database:
             conn.commit()
             return True
         except Exception as e:
+            conn.rollback()
             logging.error(f"Ошибка при отметке уведомления: {e}")
             return False
-        finally:
-            conn.close()
     
     def mark_bonus_paid(self, referrer_id: int, referred_id: int) -> bool:
         """Отметить, что бонус выплачен"""
-        conn = self.get_connection()
+        conn = self.conn
         cursor = conn.cursor()
         
         try:
@@ -433,14 +661,13 @@ class Database:
             conn.commit()
             return True
         except Exception as e:
+            conn.rollback()
             logging.error(f"Ошибка при отметке бонуса: {e}")
             return False
-        finally:
-            conn.close()
     
     def set_admin(self, user_id: int, is_admin: bool = True) -> bool:
         """Установить/снять статус администратора"""
-        conn = self.get_connection()
+        conn = self.conn
         cursor = conn.cursor()
         
         try:
@@ -451,15 +678,20 @@ class Database:
             """, (1 if is_admin else 0, user_id))
             
             conn.commit()
+            self.user_cache.invalidate(user_id)
             return True
         except Exception as e:
+            conn.rollback()
             logging.error(f"Ошибка при установке статуса админа: {e}")
             return False
-        finally:
-            conn.close()
     
     def is_admin(self, user_id: int) -> bool:
-        """Проверка, является ли пользователь администратором"""
+        """
+        Проверка, является ли пользователь администратором
+        
+        Статус из БД читается через кэш пользователей: снятие админа другим процессом
+        (set_admin.py) вступает в силу не позже чем через USER_CACHE_TTL секунд
+        """
         # Проверяем список постоянных админов из config
         from config import ADMIN_USER_IDS
         if user_id in ADMIN_USER_IDS:
@@ -467,12 +699,13 @@ class Database:
         
         # Проверяем статус в БД
         user = self.get_user(user_id)
-        return user and user.get("is_admin") == 1
+        return bool(user) and user.get("is_admin") == 1
     
-    def get_all_users(self) -> List[Dict]:
+    def get_all_users(self) -> List[UserListRow]:
         """Получение списка всех пользователей"""
-        conn = self.get_connection()
+        conn = self.conn
         cursor = conn.cursor()
+        cursor.row_factory = row_factory(UserListRow)
         
         cursor.execute("""
         SELECT user_id, username, full_name, category, referrer_id, created_at, phone_number, is_registered_in_park
@@ -480,26 +713,11 @@ class Database:
         ORDER BY created_at DESC
         """)
         
-        rows = cursor.fetchall()
-        conn.close()
-        
-        return [
-            {
-                "user_id": row[0],
-                "username": row[1],
-                "full_name": row[2],
-                "category": row[3],
-                "referrer_id": row[4],
-                "created_at": row[5],
-                "phone_number": row[6],
-                "is_registered_in_park": row[7]
-            }
-            for row in rows
-        ]
+        return cursor.fetchall()
     
     def get_user_stats(self, user_id: int) -> Dict:
         """Получение статистики пользователя"""
-        conn = self.get_connection()
+        conn = self.conn
         cursor = conn.cursor()
         
         # Количество приглашённых
@@ -515,61 +733,124 @@ class Database:
         """, (user_id,))
         completed_count = cursor.fetchone()[0]
         
-        conn.close()
-        
         return {
             "invited_count": invited_count,
             "completed_count": completed_count
         }
 
-    def get_referral_stats(self) -> List[Dict]:
-        """Получение статистики по всем рефералам"""
-        conn = self.get_connection()
+    def get_statistics(self, thresholds: Dict[str, int]) -> Dict:
+        """
+        Общая статистика для админ-панели агрегирующими запросами
+        
+        Args:
+            thresholds: Порог заказов для бонуса по позиции в парке ({"cargo": 30, ...})
+        """
+        conn = self.conn
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+        SELECT COUNT(*),
+               COALESCE(SUM(is_registered_in_park = 1), 0),
+               COALESCE(SUM(referrer_id IS NOT NULL AND referrer_id != 0), 0)
+        FROM users
+        """)
+        total_users, registered_in_park, referred_users = cursor.fetchone()
+        
+        # Категории - только у тех, кто ещё не зарегистрирован в парке
+        cursor.execute("""
+        SELECT category, COUNT(*) FROM users
+        WHERE COALESCE(is_registered_in_park, 0) = 0
+        GROUP BY category
+        ORDER BY COUNT(*) DESC
+        """)
+        by_category = dict(cursor.fetchall())
+        
+        # Записи рефералов, у которых есть и реферер, и приглашённый
+        cursor.execute("""
+        SELECT COUNT(*) FROM referrals r
+        JOIN users referrer ON r.referrer_id = referrer.user_id
+        JOIN users referred ON r.referred_id = referred.user_id
+        """)
+        total_referrals = cursor.fetchone()[0]
+        
+        goal_reached = {}
+        for park_position, threshold in thresholds.items():
+            cursor.execute("""
+            SELECT COUNT(*) FROM referrals
+            WHERE park_position = ? AND orders_count >= ?
+            """, (park_position, threshold))
+            goal_reached[park_position] = cursor.fetchone()[0]
+        
+        return {
+            "total_users": total_users,
+            "registered_in_park": registered_in_park,
+            "not_registered": total_users - registered_in_park,
+            "referred_users": referred_users,
+            "by_category": by_category,
+            "total_referrals": total_referrals,
+            "goal_reached": goal_reached
+        }
+    
+    def get_referral_stats(self, offset: int = 0, limit: Optional[int] = None) -> List[ReferralStatsRow]:
+        """Получение статистики по рефералам (страница из limit записей, начиная с offset) одним запросом"""
+        conn = self.conn
         cursor = conn.cursor()
+        cursor.row_factory = row_factory(ReferralStatsRow)
         
         cursor.execute("""
         SELECT 
             referrer.user_id as referrer_user_id,
             referrer.full_name as referrer_full_name,
             referrer.username as referrer_username,
+            referrer.phone_number as referrer_phone_number,
+            referrer.category as referrer_category,
+            referrer.park_position as referrer_park_position,
             referred.user_id as referred_user_id,
             referred.full_name as referred_full_name,
             referred.username as referred_username,
-            COALESCE(r.orders_count, 0) as orders_count
+            referred.phone_number as referred_phone_number,
+            referred.category as referred_category,
+            referred.park_position as referred_park_position,
+            referred.is_registered_in_park as referred_is_registered_in_park,
+            referred.yandex_driver_id as referred_yandex_driver_id,
+            COALESCE(r.orders_count, 0) as orders_count,
+            r.orders_updated_at
+        FROM referrals r
+        JOIN users referrer ON r.referrer_id = referrer.user_id
+        JOIN users referred ON r.referred_id = referred.user_id
+        ORDER BY referrer.created_at DESC, r.created_at DESC, r.id DESC
+        LIMIT ? OFFSET ?
+        """, (-1 if limit is None else limit, offset))
+        
+        return cursor.fetchall()
+    
+    def get_referral_stats_count(self) -> int:
+        """Количество записей в get_referral_stats"""
+        conn = self.conn
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+        SELECT COUNT(*)
         FROM referrals r
         JOIN users referrer ON r.referrer_id = referrer.user_id
         JOIN users referred ON r.referred_id = referred.user_id
-        ORDER BY referrer.created_at DESC, r.created_at DESC
         """)
         
-        rows = cursor.fetchall()
-        conn.close()
-        
-        return [
-            {
-                "referrer_user_id": row[0],
-                "referrer_full_name": row[1],
-                "referrer_username": row[2],
-                "referred_user_id": row[3],
-                "referred_full_name": row[4],
-                "referred_username": row[5],
-                "orders_count": int(row[6]) if row[6] is not None else 0,
-            }
-            for row in rows
-        ]
+        return cursor.fetchone()[0]
 
-    def get_invited_users_with_order_count(self, referrer_id: int) -> List[Dict]:
+    def get_invited_users_with_order_count(self, referrer_id: int) -> List[InvitedUserRow]:
         """Получение списка приглашенных пользователем с количеством их заказов"""
-        conn = self.get_connection()
+        conn = self.conn
         cursor = conn.cursor()
+        cursor.row_factory = row_factory(InvitedUserRow)
 
         try:
             logging.info(f"Executing query for referrer_id: {referrer_id}")
             cursor.execute("""
             SELECT 
-                u.full_name,
-                u.username,
-                u.phone_number,
+                COALESCE(NULLIF(u.full_name, ''), 'Не указано') as full_name,
+                NULLIF(u.username, '') as username,
+                NULLIF(u.phone_number, '') as phone_number,
                 COALESCE(r.orders_count, 0) as orders_count
             FROM referrals r
             JOIN users u ON r.referred_id = u.user_id
@@ -577,24 +858,169 @@ class Database:
             ORDER BY r.created_at DESC
             """, (referrer_id,))
             
-            rows = cursor.fetchall()
-            logging.info(f"Query returned {len(rows)} rows for referrer_id: {referrer_id}")
-            
-            result = [
-                {
-                    "full_name": row[0] if row[0] else "Не указано",
-                    "username": row[1] if row[1] else None,
-                    "phone_number": row[2] if row[2] else None,
-                    "orders_count": int(row[3]) if row[3] is not None else 0,
-                }
-                for row in rows
-            ]
+            result = cursor.fetchall()
+            logging.info(f"Query returned {len(result)} rows for referrer_id: {referrer_id}")
             
             logging.info(f"Returning result: {result}")
             return result
         except Exception as e:
             logging.error(f"Error in get_invited_users_with_order_count: {e}", exc_info=True)
             return []
-        finally:
-            conn.close()
+
+    def get_order_watermark(self, yandex_driver_id: str) -> Optional[WatermarkRow]:
+        """Получение отметки инкрементального подсчёта заказов водителя"""
+        conn = self.conn
+        cursor = conn.cursor()
+        cursor.row_factory = row_factory(WatermarkRow)
+        
+        cursor.execute("""
+        SELECT last_ended_at, COALESCE(orders_count, 0), full_sync_at, updated_at
+        FROM order_watermarks WHERE yandex_driver_id = ?
+        """, (yandex_driver_id,))
+        
+        return cursor.fetchone()
+    
+    def get_driver_position(self, yandex_driver_id: str, max_age_days: float = 30) -> Optional[DriverPositionRow]:
+        """
+        Получение сохранённой позиции водителя, если она не старше max_age_days.
+        Возвращает park_position и автомобиль (car_brand, car_model, cargo_type)
+        """
+        conn = self.conn
+        cursor = conn.cursor()
+        cursor.row_factory = row_factory(DriverPositionRow)
+        
+        cursor.execute("""
+        SELECT yandex_driver_id, park_position, car_brand, car_model, cargo_type, updated_at
+        FROM driver_positions
+        WHERE yandex_driver_id = ? AND updated_at >= datetime('now', ?)
+        """, (yandex_driver_id, f"-{max_age_days} days"))
+        
+        return cursor.fetchone()
+    
+    def save_driver_position(self, yandex_driver_id: str, park_position: str, car: Dict) -> bool:
+        """Сохранение позиции водителя вместе с автомобилем, по которому она определена"""
+        conn = self.conn
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute(_UPSERT_DRIVER_POSITION, _driver_position_params(yandex_driver_id, park_position, car))
+            conn.commit()
+            return True
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Ошибка при сохранении позиции водителя {yandex_driver_id}: {e}")
+            return False
+    
+    def get_stale_driver_positions(self, max_age_days: float = 30, limit: int = 100) -> List[DriverPositionRow]:
+        """Водители, позиция которых определялась раньше max_age_days назад (самые старые первыми)"""
+        conn = self.conn
+        cursor = conn.cursor()
+        cursor.row_factory = row_factory(DriverPositionRow)
+        
+        cursor.execute("""
+        SELECT yandex_driver_id, park_position, car_brand, car_model, cargo_type, updated_at
+        FROM driver_positions
+        WHERE updated_at < datetime('now', ?)
+        ORDER BY updated_at
+        LIMIT ?
+        """, (f"-{max_age_days} days", limit))
+        
+        return cursor.fetchall()
+    
+    def compact_orders_log(self) -> int:
+        """Прореживание и очистка старой истории заказов; возвращает число удалённых точек"""
+        conn = self.conn
+        cursor = conn.cursor()
+        
+        try:
+            # Последнюю точку пользователя не удаляем даже старше KEEP_DAYS: точки пишутся только
+            # при изменении, и без неё у давно не менявшегося счётчика не останется базы для скорости
+            cursor.execute("""
+            DELETE FROM orders_log
+            WHERE updated_at < datetime('now', ?)
+              AND id NOT IN (SELECT MAX(id) FROM orders_log GROUP BY user_id)
+            """, (f"-{self.ORDERS_LOG_KEEP_DAYS} days",))
+            deleted = cursor.rowcount
+            
+            # Старше RAW_DAYS оставляем по одной (последней) точке на пользователя за день
+            cursor.execute("""
+            DELETE FROM orders_log
+            WHERE updated_at < datetime('now', ?1)
+              AND id NOT IN (
+                  SELECT MAX(id) FROM orders_log
+                  WHERE updated_at < datetime('now', ?1)
+                  GROUP BY user_id, date(updated_at)
+              )
+            """, (f"-{self.ORDERS_LOG_RAW_DAYS} days",))
+            deleted += cursor.rowcount
+            
+            conn.commit()
+            return deleted
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Ошибка при прореживании истории заказов: {e}")
+            return 0
+    
+    def _order_history_span(self, user_id: int, days: float) -> Optional[Tuple[int, int, float]]:
+        """
+        Количество заказов в начале окна (или на первой точке внутри окна), текущее
+        количество и длина промежутка между ними до текущего момента, суток
+        """
+        cursor = self.conn.cursor()
+        window = f"-{days} days"
+        
+        # Точки пишутся только при изменении, поэтому значение до окна действует на его начало
+        cursor.execute("""
+        SELECT order_count FROM orders_log
+        WHERE user_id = ? AND updated_at < datetime('now', ?)
+        ORDER BY updated_at DESC, id DESC LIMIT 1
+        """, (user_id, window))
+        row = cursor.fetchone()
+        if row:
+            start_count, elapsed_days = row[0], days
+        else:
+            cursor.execute("""
+            SELECT order_count, julianday('now') - julianday(updated_at) FROM orders_log
+            WHERE user_id = ? AND updated_at >= datetime('now', ?)
+            ORDER BY updated_at, id LIMIT 1
+            """, (user_id, window))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            start_count, elapsed_days = row
+        
+        cursor.execute("""
+        SELECT order_count FROM orders_log WHERE user_id = ?
+        ORDER BY updated_at DESC, id DESC LIMIT 1
+        """, (user_id,))
+        current_count = cursor.fetchone()[0]
+        return start_count, current_count, elapsed_days
+    
+    def get_order_velocity(self, user_id: int, days: float = 14) -> Optional[float]:
+        """
+        Скорость выполнения заказов пользователем за последние days суток по истории (заказов в сутки).
+        None, если истории недостаточно
+        """
+        span = self._order_history_span(user_id, days)
+        if span is None:
+            return None
+        start_count, current_count, elapsed_days = span
+        if elapsed_days < self.MIN_VELOCITY_SPAN_DAYS:
+            return None
+        return max(current_count - start_count, 0) / elapsed_days
+    
+    def get_order_eta(self, user_id: int, threshold: int, days: float = 14) -> Optional[float]:
+        """
+        Через сколько суток пользователь наберёт threshold заказов при скорости за последние days суток.
+        0 - порог уже достигнут; None - истории недостаточно или заказов за окно не было
+        """
+        span = self._order_history_span(user_id, days)
+        if span is None:
+            return None
+        start_count, current_count, elapsed_days = span
+        if current_count >= threshold:
+            return 0.0
+        if elapsed_days < self.MIN_VELOCITY_SPAN_DAYS or current_count <= start_count:
+            return None
+        return (threshold - current_count) * elapsed_days / (current_count - start_count)
 
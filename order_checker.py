@@ -2,9 +2,12 @@ import asyncio
 import logging
 from database import Database
 from yandex_park_api import YandexParkAPI
-from config import YANDEX_PARK_ID, YANDEX_API_KEY, YANDEX_CLIENT_ID, NOTIFICATION_CHANNEL_ID, BOT_TOKEN
+from config import YANDEX_PARK_ID, YANDEX_API_KEY, YANDEX_CLIENT_ID, NOTIFICATION_CHANNEL_ID, BOT_TOKEN, YANDEX_API_RPS, YANDEX_API_MAX_RPS, ORDER_CHECK_WORKERS, ORDERS_THRESHOLD
+from config import ORDERS_FULL_RESYNC_DAYS
 from aiogram import Bot
 import time
+from typing import Optional, Tuple
+from datetime import datetime, timedelta
 
 # Настройка логирования
 logging.basicConfig(
@@ -22,11 +25,20 @@ logging.getLogger('').addHandler(console)
 # Инициализация бота для отправки уведомлений
 bot = Bot(token=BOT_TOKEN)
 
-# Пороговые значения заказов для разных позиций
-ORDERS_THRESHOLD = {
-    "cargo": 30,  # Грузовой - 30 заказов
-    "express": 45  # Экспресс - 45 заказов
-}
+# Как часто инкрементальный счётчик перепроверяется полным пересчётом истории. Пересчёт
+# стоит O(истории) запросов, поэтому между ними заказы считаются только от отметки
+FULL_RESYNC_INTERVAL = timedelta(days=ORDERS_FULL_RESYNC_DAYS)
+
+# С какого числа водителей выгоднее один проход по заказам всего парка, чем запросы по каждому
+BULK_MODE_MIN_DRIVERS = 20
+# Водители, не проверявшиеся дольше этого, считаются по отдельности, чтобы не раздувать окно выгрузки
+BULK_MAX_WINDOW = timedelta(days=2)
+# Запас на расхождение часов и задержку появления заказов в API
+BULK_WINDOW_OVERLAP = timedelta(minutes=10)
+# Сколько устаревших позиций водителей переопределять за один цикл
+POSITION_REFRESH_BATCH = 100
+# Сколько результатов проверки записывать в БД одной транзакцией
+WRITE_BATCH_SIZE = 100
 
 
 async def send_referrer_notification(referrer_id: int, referred: dict, park_position: str, orders_count: int):
@@ -87,11 +99,9 @@ async def send_referred_notification(referred_id: int, referrer: dict, park_posi
         logging.error(f"Ошибка при отправке уведомления рефералу {referred_id}: {e}", exc_info=True)
 
 
-async def send_goal_notification(referrer_id: int, referred_id: int, park_position: str, orders_count: int):
+async def send_goal_notification(db: Database, referrer_id: int, referred_id: int, park_position: str, orders_count: int):
     """Отправляет уведомление в канал и пользователям о достижении цели рефералом"""
     try:
-        db = Database()
-        
         # Получаем информацию о реферере и реферале
         referrer = db.get_user(referrer_id)
         referred = db.get_user(referred_id)
@@ -134,110 +144,341 @@ async def send_goal_notification(referrer_id: int, referred_id: int, park_positi
         logging.error(f"Ошибка при отправке уведомления о достижении цели: {e}", exc_info=True)
 
 
-async def check_orders():
+def _parse_db_time(value: str) -> datetime:
+    """Разбирает CURRENT_TIMESTAMP из SQLite (UTC)"""
+    return datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+
+
+def _is_incremental(watermark: Optional[dict]) -> bool:
+    """Можно ли считать заказы водителя от отметки, без полного пересчёта"""
+    if not watermark or not watermark.get("last_ended_at") or not watermark.get("full_sync_at"):
+        return False
+    return datetime.utcnow() - _parse_db_time(watermark["full_sync_at"]) <= FULL_RESYNC_INTERVAL
+
+
+async def fetch_orders_count(db: Database, yandex_api: YandexParkAPI,
+                             yandex_driver_id: str) -> Tuple[Optional[int], Optional[tuple]]:
+    """
+    Возвращает количество заказов водителя, запрашивая у API только заказы после сохранённой отметки.
+    
+    Без отметки (или раз в FULL_RESYNC_INTERVAL) выполняется полный пересчёт истории.
+    Отметка не записывается здесь, а возвращается для save_check_results:
+    (orders_count, (yandex_driver_id, last_ended_at, orders_count, full_sync) или None).
+    При ошибке API возвращает (None, None).
+    """
+    watermark = db.get_order_watermark(yandex_driver_id)
+    
+    if _is_incremental(watermark):
+        stats = await yandex_api.get_driver_orders_stats(yandex_driver_id, since=watermark["last_ended_at"])
+        if stats is None:
+            return None, None
+        orders_count = watermark["orders_count"] + stats["count"]
+        logging.info(f"[ORDERS_INCREMENTAL] Driver {yandex_driver_id}: +{stats['count']} заказов после {watermark['last_ended_at']}, итого {orders_count}")
+        if not stats["complete"]:
+            # Заказы после отметки прочитаны не все: сдвинув отметку, пропустили бы непосчитанные
+            return orders_count, None
+        return orders_count, (yandex_driver_id, stats["last_ended_at"] or watermark["last_ended_at"], orders_count, False)
+    
+    stats = await yandex_api.get_driver_orders_stats(yandex_driver_id)
+    if stats is None:
+        return None, None
+    # Отметку сохраняем только если история прочитана полностью
+    if stats["complete"] and stats["last_ended_at"]:
+        return stats["count"], (yandex_driver_id, stats["last_ended_at"], stats["count"], True)
+    return stats["count"], None
+
+
+async def fetch_bulk_orders_counts(db: Database, yandex_api: YandexParkAPI, driver_ids: list) -> dict:
+    """
+    Считает заказы сразу для всех подходящих водителей одним проходом по заказам парка.
+    
+    Участвуют водители с актуальной отметкой, проверенные не раньше BULK_MAX_WINDOW назад;
+    остальные (и все, если таких меньше BULK_MODE_MIN_DRIVERS) остаются для проверки по одному.
+    
+    Returns:
+        Dict driver_id -> (количество заказов, отметка для save_check_results) для посчитанных водителей
+    """
+    now = datetime.utcnow()
+    watermarks = {}
+    for driver_id in set(driver_ids):
+        watermark = db.get_order_watermark(driver_id)
+        if _is_incremental(watermark) and now - _parse_db_time(watermark["checked_at"]) <= BULK_MAX_WINDOW:
+            watermarks[driver_id] = watermark
+    
+    if len(watermarks) < BULK_MODE_MIN_DRIVERS:
+        logging.info(f"[CHECK_CYCLE] Проверка по одному водителю (кандидатов для общего прохода: {len(watermarks)})")
+        return {}
+    
+    # Всё, что завершилось до последней проверки водителя, уже учтено в его счётчике,
+    # поэтому окну достаточно начинаться от самой старой проверки
+    from datetime import timezone
+    oldest_check = min(_parse_db_time(w["checked_at"]) for w in watermarks.values())
+    since = oldest_check.replace(tzinfo=timezone.utc) - BULK_WINDOW_OVERLAP
+    
+    stats = await yandex_api.get_park_orders_stats(
+        {driver_id: w["last_ended_at"] for driver_id, w in watermarks.items()}, since
+    )
+    if stats is None:
+        logging.warning("[CHECK_CYCLE] Общий проход по заказам парка не удался, проверяем водителей по одному")
+        return {}
+    
+    counts = {}
+    for driver_id, watermark in watermarks.items():
+        driver_stats = stats[driver_id]
+        orders_count = watermark["orders_count"] + driver_stats["count"]
+        last_ended_at = driver_stats["last_ended_at"] or watermark["last_ended_at"]
+        counts[driver_id] = (orders_count, (driver_id, last_ended_at, orders_count, False))
+    
+    logging.info(f"[CHECK_CYCLE] Общим проходом посчитано водителей: {len(counts)}")
+    return counts
+
+
+async def resolve_driver_position(db: Database, yandex_api: YandexParkAPI,
+                                  yandex_driver_id: str) -> Tuple[Optional[str], Optional[dict]]:
+    """
+    Позиция водителя: из сохранённых в БД, иначе по автомобилю из справочника
+    (или из API, если водителя в справочнике нет).
+    
+    Возвращает (park_position, car); car не None, если позиция определена заново
+    и её нужно сохранить через save_check_results. (None, None) - определить не удалось.
+    """
+    cached = db.get_driver_position(yandex_driver_id)
+    if cached:
+        return cached["park_position"], None
+    
+    car = yandex_api.get_roster_car(yandex_driver_id)
+    if car is None:
+        car = await yandex_api.get_driver_car(yandex_driver_id)
+        if car is None:
+            return None, None
+    
+    return YandexParkAPI.classify_position(car), car
+
+
+async def refresh_driver_positions(db: Database, yandex_api: YandexParkAPI):
+    """Переопределяет устаревшие позиции водителей пачкой по одному проходу справочника"""
+    stale = db.get_stale_driver_positions(limit=POSITION_REFRESH_BATCH)
+    if not stale:
+        return
+    
+    logging.info(f"[POSITIONS] Обновляем устаревшие позиции водителей: {len(stale)}")
+    error = await yandex_api.refresh_roster()
+    if error:
+        logging.warning(f"[POSITIONS] Справочник водителей не обновлён ({error}), запрашиваем по одному")
+    
+    driver_positions = []
+    changed = 0
+    for entry in stale:
+        driver_id = entry["yandex_driver_id"]
+        car = yandex_api.get_roster_car(driver_id)
+        if car is None:
+            car = await yandex_api.get_driver_car(driver_id)
+            if car is None:
+                # Не удалось получить автомобиль - оставляем старую позицию до следующего цикла
+                continue
+        
+        park_position = YandexParkAPI.classify_position(car)
+        driver_positions.append((driver_id, park_position, car))
+        if park_position != entry["park_position"]:
+            changed += 1
+            logging.info(f"[POSITIONS] Водитель {driver_id}: {entry['park_position']} -> {park_position}")
+    
+    # Позиции и их перенос на пользователей - одной транзакцией
+    if not db.save_check_results([], driver_positions=driver_positions):
+        logging.error(f"[POSITIONS] ✗ Не удалось сохранить позиции водителей: {len(driver_positions)}")
+        return
+    logging.info(f"[POSITIONS] Позиция изменилась у водителей: {changed}")
+
+
+async def check_driver(db: Database, yandex_api: YandexParkAPI, referral: dict, bulk_counts: dict, idx: int) -> dict:
+    """
+    Запрашивает у API позицию (если не известна) и количество заказов одного водителя.
+    В БД ничего не пишет: отметка подсчёта и позиция водителя возвращаются для пачки писателя
+    """
+    referred_id = referral["referred_id"]
+    yandex_driver_id = referral["yandex_driver_id"]
+    park_position = referral.get("park_position")
+    position_found = False
+    driver_position = None
+    
+    # Если позиция не определена, пытаемся её определить
+    if not park_position and yandex_driver_id:
+        logging.info(f"[CHECK_{idx}] Позиция не определена, определяем...")
+        park_position, car = await resolve_driver_position(db, yandex_api, yandex_driver_id)
+        if park_position:
+            position_found = True
+            if car is not None:
+                driver_position = (yandex_driver_id, park_position, car)
+            logging.info(f"[CHECK_{idx}] Определена позиция для водителя {yandex_driver_id}: {park_position}")
+        else:
+            logging.warning(f"[CHECK_{idx}] Не удалось определить позицию для {yandex_driver_id}")
+    
+    # Получаем количество заказов (из общего прохода или из API по водителю)
+    if yandex_driver_id in bulk_counts:
+        orders_count, watermark = bulk_counts[yandex_driver_id]
+    else:
+        logging.info(f"[CHECK_{idx}] Запрашиваем заказы из API для driver_id={yandex_driver_id}...")
+        orders_count, watermark = await fetch_orders_count(db, yandex_api, yandex_driver_id)
+    
+    if orders_count is None:
+        logging.warning(f"[CHECK_{idx}] ✗ Could not get orders count for driver {yandex_driver_id} (user {referred_id}). API вернул None.")
+    
+    return {
+        "park_position": park_position,
+        "position_found": position_found,
+        "orders_count": orders_count,
+        "watermark": watermark,
+        "driver_position": driver_position
+    }
+
+
+def new_check_batch() -> dict:
+    """Пачка результатов проверки на запись: аргументы save_check_results"""
+    return {"results": [], "watermarks": [], "driver_positions": []}
+
+
+def flush_check_results(db: Database, batch: dict, notified: list = ()):
+    """Записывает накопленные результаты проверки (вместе с отметками и позициями водителей) одной транзакцией"""
+    if not batch["results"] and not notified:
+        return
+    if db.save_check_results(batch["results"], notified, batch["watermarks"], batch["driver_positions"]):
+        logging.info(f"[CHECK_CYCLE] ✓ Сохранено в БД результатов: {len(batch['results'])}, отметок об уведомлении: {len(notified)}")
+    else:
+        logging.error(f"[CHECK_CYCLE] ✗ Не удалось сохранить в БД результаты: {len(batch['results'])}")
+    for items in batch.values():
+        items.clear()
+
+
+async def apply_check_result(db: Database, referral: dict, result: dict, idx: int, batch: dict):
+    """
+    Добавляет результат проверки водителя в пачку на запись и отправляет уведомление
+    о достижении цели (перед этим пачка записывается вместе с отметкой об уведомлении)
+    """
+    referred_id = referral["referred_id"]
+    referrer_id = referral.get("referrer_id")
+    yandex_driver_id = referral["yandex_driver_id"]
+    current_orders_count = referral.get("orders_count", 0)
+    notification_sent = referral.get("notification_sent", 0)
+    park_position = result["park_position"]
+    orders_count = result["orders_count"]
+    
+    # Позиция пишется, только если её только что определили
+    batch["results"].append((referred_id, orders_count, park_position if result["position_found"] else None))
+    if result["watermark"]:
+        batch["watermarks"].append(result["watermark"])
+    if result["driver_position"]:
+        batch["driver_positions"].append(result["driver_position"])
+    
+    if orders_count is None:
+        return
+    
+    logging.info(f"[CHECK_{idx}] ✓ Driver {yandex_driver_id} (user {referred_id}): получено {orders_count} заказов (было в БД: {current_orders_count})")
+    
+    # Проверяем, достиг ли реферал нужного числа заказов
+    if park_position and park_position in ORDERS_THRESHOLD:
+        threshold = ORDERS_THRESHOLD[park_position]
+        logging.info(f"[CHECK_{idx}] Проверка порога: {orders_count} >= {threshold}? notification_sent={notification_sent}")
+        
+        # Если достигнута цель и уведомление еще не отправлялось
+        if orders_count >= threshold and not notification_sent and referrer_id:
+            logging.info(f"[CHECK_{idx}] 🎉 Реферал {referred_id} достиг цели: {orders_count} заказов (требуется {threshold} для {park_position})")
+            
+            # Отправляем уведомление в канал
+            await send_goal_notification(db, referrer_id, referred_id, park_position, orders_count)
+            
+            # Сразу записываем пачку с отметкой об уведомлении, чтобы не отправить его повторно
+            flush_check_results(db, batch, [(referrer_id, referred_id)])
+        elif not referrer_id:
+            logging.warning(f"[CHECK_{idx}] Пользователь {referred_id} достиг порога, но нет referrer_id")
+    else:
+        logging.warning(f"[CHECK_{idx}] Позиция не определена или не в пороговых значениях: park_position={park_position}")
+
+
+async def check_orders(yandex_api: YandexParkAPI, db: Database):
     """Основная функция для проверки заказов"""
     logging.info("=" * 80)
     logging.info("[CHECK_CYCLE] Starting order check cycle...")
     
-    db = Database()
-    yandex_api = YandexParkAPI(YANDEX_PARK_ID, YANDEX_API_KEY, YANDEX_CLIENT_ID)
-    
     # Получаем всех рефералов, которых нужно проверить
     referrals_to_check = db.get_referrals_for_order_check()
     
     logging.info(f"[CHECK_CYCLE] Метод get_referrals_for_order_check() вернул: {len(referrals_to_check)} записей")
     
-    # Также логируем ВСЕХ пользователей в парке для отладки
-    all_park_users = db.get_all_park_users_for_order_check()
-    logging.info(f"[CHECK_CYCLE] Всего пользователей в парке (метод get_all_park_users_for_order_check): {len(all_park_users)}")
-    
     if not referrals_to_check:
         logging.warning("[CHECK_CYCLE] No referrals found in get_referrals_for_order_check()!")
         logging.info("[CHECK_CYCLE] Проверяем альтернативный метод...")
         
-        # Используем альтернативный метод, если основной не нашел записей
-        if all_park_users:
-            logging.info(f"[CHECK_CYCLE] Используем альтернативный список: {len(all_park_users)} пользователей")
-            referrals_to_check = all_park_users
+        # Используем альтернативный метод (всех пользователей в парке), если основной не нашел записей
+        referrals_to_check = db.get_all_park_users_for_order_check()
+        if referrals_to_check:
+            logging.info(f"[CHECK_CYCLE] Используем альтернативный список: {len(referrals_to_check)} пользователей")
         else:
             logging.info("[CHECK_CYCLE] Нет пользователей для проверки.")
             return
     
     logging.info(f"[CHECK_CYCLE] Будет проверено {len(referrals_to_check)} пользователей")
     
-    for idx, referral in enumerate(referrals_to_check, 1):
-        referred_id = referral["referred_id"]
-        referrer_id = referral.get("referrer_id")
-        yandex_driver_id = referral["yandex_driver_id"]
-        park_position = referral.get("park_position")
-        current_orders_count = referral.get("orders_count", 0)
-        notification_sent = referral.get("notification_sent", 0)
-        
-        logging.info(f"[CHECK_{idx}/{len(referrals_to_check)}] Проверяем user_id={referred_id}, driver_id={yandex_driver_id}, referrer_id={referrer_id}")
-        
-        try:
-            # Если позиция не определена, пытаемся её определить
-            if not park_position and yandex_driver_id:
-                logging.info(f"[CHECK_{idx}] Позиция не определена, определяем...")
-                park_position = await yandex_api.get_driver_position(yandex_driver_id)
-                if park_position:
-                    db.update_user_park_position(referred_id, park_position)
-                    logging.info(f"[CHECK_{idx}] Определена позиция для водителя {yandex_driver_id}: {park_position}")
-                    # Обновляем позицию в referrals
-                    conn = db.get_connection()
-                    cursor = conn.cursor()
-                    try:
-                        cursor.execute("""
-                        UPDATE referrals
-                        SET park_position = ?
-                        WHERE referred_id = ?
-                        """, (park_position, referred_id))
-                        conn.commit()
-                    finally:
-                        conn.close()
-                else:
-                    logging.warning(f"[CHECK_{idx}] Не удалось определить позицию для {yandex_driver_id}")
-            
-            # Получаем количество заказов из API
-            logging.info(f"[CHECK_{idx}] Запрашиваем заказы из API для driver_id={yandex_driver_id}...")
-            orders_count = await yandex_api.get_driver_orders_count(yandex_driver_id)
-            
-            if orders_count is not None:
-                logging.info(f"[CHECK_{idx}] ✓ Driver {yandex_driver_id} (user {referred_id}): получено {orders_count} заказов (было в БД: {current_orders_count})")
-                
-                # Обновляем количество заказов в БД
-                update_success = db.update_orders_count(referred_id, orders_count)
-                if update_success:
-                    logging.info(f"[CHECK_{idx}] ✓ Обновлено в БД: user_id={referred_id}, orders_count={orders_count}")
-                else:
-                    logging.error(f"[CHECK_{idx}] ✗ Не удалось обновить БД для user_id={referred_id}")
-                
-                # Проверяем, достиг ли реферал нужного числа заказов
-                if park_position and park_position in ORDERS_THRESHOLD:
-                    threshold = ORDERS_THRESHOLD[park_position]
-                    logging.info(f"[CHECK_{idx}] Проверка порога: {orders_count} >= {threshold}? notification_sent={notification_sent}")
-                    
-                    # Если достигнута цель и уведомление еще не отправлялось
-                    if orders_count >= threshold and not notification_sent and referrer_id:
-                        logging.info(f"[CHECK_{idx}] 🎉 Реферал {referred_id} достиг цели: {orders_count} заказов (требуется {threshold} для {park_position})")
-                        
-                        # Отправляем уведомление в канал
-                        await send_goal_notification(referrer_id, referred_id, park_position, orders_count)
-                        
-                        # Отмечаем, что уведомление отправлено
-                        db.mark_notification_sent(referrer_id, referred_id)
-                    elif not referrer_id:
-                        logging.warning(f"[CHECK_{idx}] Пользователь {referred_id} достиг порога, но нет referrer_id")
-                else:
-                    logging.warning(f"[CHECK_{idx}] Позиция не определена или не в пороговых значениях: park_position={park_position}")
-            else:
-                logging.warning(f"[CHECK_{idx}] ✗ Could not get orders count for driver {yandex_driver_id} (user {referred_id}). API вернул None.")
-        
-        except Exception as e:
-            logging.error(f"[CHECK_{idx}] ✗ Error checking orders for driver {yandex_driver_id}: {e}", exc_info=True)
-        
-        # Небольшая задержка, чтобы не перегружать API
-        await asyncio.sleep(1.5)
+    # Много водителей - считаем новые заказы одним проходом по парку
+    bulk_counts = await fetch_bulk_orders_counts(
+        db, yandex_api, [r["yandex_driver_id"] for r in referrals_to_check]
+    )
+    
+    # Водителей проверяют несколько воркеров параллельно; темп запросов держит
+    # общий rate limiter клиента API, а результаты записывает один писатель
+    total = len(referrals_to_check)
+    pending = asyncio.Queue()
+    for item in enumerate(referrals_to_check, 1):
+        pending.put_nowait(item)
+    results = asyncio.Queue()
+    skipped = []
+    
+    async def worker():
+        while True:
+            try:
+                idx, referral = pending.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            if yandex_api.circuit_breaker.is_open:
+                # API лежит - не тратим цикл на заведомо неудачные запросы
+                skipped.append(idx)
+                await results.put((idx, referral, None))
+                continue
+            logging.info(f"[CHECK_{idx}/{total}] Проверяем user_id={referral['referred_id']}, driver_id={referral['yandex_driver_id']}, referrer_id={referral.get('referrer_id')}")
+            try:
+                result = await check_driver(db, yandex_api, referral, bulk_counts, idx)
+            except Exception as e:
+                logging.error(f"[CHECK_{idx}] ✗ Error checking orders for driver {referral['yandex_driver_id']}: {e}", exc_info=True)
+                result = None
+            await results.put((idx, referral, result))
+    
+    async def writer():
+        batch = new_check_batch()
+        for _ in range(total):
+            idx, referral, result = await results.get()
+            if result is None:
+                continue
+            try:
+                await apply_check_result(db, referral, result, idx, batch)
+            except Exception as e:
+                logging.error(f"[CHECK_{idx}] ✗ Error saving result for driver {referral['yandex_driver_id']}: {e}", exc_info=True)
+            if len(batch["results"]) >= WRITE_BATCH_SIZE:
+                flush_check_results(db, batch)
+        flush_check_results(db, batch)
+    
+    workers_count = max(1, min(ORDER_CHECK_WORKERS, total))
+    logging.info(f"[CHECK_CYCLE] Воркеров: {workers_count}, лимит API: {yandex_api.rate_limiter.rate} запр/с")
+    await asyncio.gather(writer(), *(worker() for _ in range(workers_count)))
+    if skipped:
+        logging.warning(f"[CHECK_CYCLE] Fleet API недоступен, пропущено водителей: {len(skipped)} (будут проверены в следующем цикле)")
+    
+    try:
+        await refresh_driver_positions(db, yandex_api)
+    except Exception as e:
+        logging.error(f"[POSITIONS] Ошибка при обновлении позиций водителей: {e}", exc_info=True)
+    
+    compacted = db.compact_orders_log()
+    if compacted:
+        logging.info(f"[CHECK_CYCLE] Прорежена история заказов: удалено точек {compacted}")
     
     logging.info("=" * 80)
     logging.info("[CHECK_CYCLE] Order check cycle finished.")
@@ -245,11 +486,14 @@ async def check_orders():
 
 async def main():
     """Запускает цикл проверки заказов каждые N секунд"""
-    while True:
-        await check_orders()
-        sleep_duration = 3600 # 1 час
-        logging.info(f"Sleeping for {sleep_duration / 60} minutes...")
-        await asyncio.sleep(sleep_duration)
+    # Один клиент API и одно соединение с БД на всё время работы процесса
+    db = Database()
+    async with YandexParkAPI(YANDEX_PARK_ID, YANDEX_API_KEY, YANDEX_CLIENT_ID, YANDEX_API_RPS, YANDEX_API_MAX_RPS) as yandex_api:
+        while True:
+            await check_orders(yandex_api, db)
+            sleep_duration = 3600 # 1 час
+            logging.info(f"Sleeping for {sleep_duration / 60} minutes...")
+            await asyncio.sleep(sleep_duration)
 
 if __name__ == "__main__":
     try:
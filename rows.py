@@ -0,0 +1,83 @@
+from typing import Any, Callable, Iterator, Tuple
+
+
+class Row:
+    """
+    Строка результата запроса с полями в __slots__ (без отдельного dict на каждую строку).
+    
+    Поля доступны как атрибуты и как ключи словаря (row["user_id"], row.get(...),
+    keys(), items(), in), поэтому код, работавший со словарями из Database, не меняется.
+    Конкретные типы строк создаются через row_type.
+    """
+    
+    __slots__ = ()
+    
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+    
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def __setitem__(self, key: str, value: Any):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+    
+    def get(self, key: str, default: Any = None) -> Any:
+        if key not in self.__slots__:
+            return default
+        return getattr(self, key)
+    
+    def keys(self) -> Tuple[str, ...]:
+        return self.__slots__
+    
+    def values(self) -> list:
+        return [getattr(self, name) for name in self.__slots__]
+    
+    def items(self) -> list:
+        return [(name, getattr(self, name)) for name in self.__slots__]
+    
+    def to_dict(self) -> dict:
+        return dict(self.items())
+    
+    def copy(self) -> "Row":
+        """Независимая копия строки (как dict.copy - значения не копируются)"""
+        return type(self)(*self.values())
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self.__slots__
+    
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__slots__)
+    
+    def __len__(self) -> int:
+        return len(self.__slots__)
+    
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (Row, dict)):
+            return self.to_dict() == dict(other.items())
+        return NotImplemented
+    
+    __hash__ = None
+    
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+def row_type(name: str, fields: str) -> type:
+    """Создаёт тип строки с полями fields (через пробел, в порядке колонок SELECT)"""
+    fields = tuple(fields.split())
+    # Как в collections.namedtuple: __init__ с явными присваиваниями быстрее цикла по полям
+    body = "".join(f"    self.{field} = {field}\n" for field in fields) or "    pass\n"
+    namespace = {}
+    exec(f"def __init__(self, {', '.join(fields)}):\n{body}", namespace)
+    return type(name, (Row,), {"__slots__": fields, "__init__": namespace["__init__"]})
+
+
+def row_factory(cls: type) -> Callable:
+    """row_factory для sqlite3.Cursor, собирающая строки типа cls"""
+    return lambda cursor, row: cls(*row)
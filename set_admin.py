@@ -6,6 +6,9 @@
   python set_admin.py add USER_ID     # Добавить администратора
   python set_admin.py remove USER_ID  # Убрать администратора
   python set_admin.py list            # Показать всех администраторов
+
+Запущенный бот кэширует пользователей: изменение статуса (в том числе снятие
+администратора) вступает в силу в нём не позже чем через Database.USER_CACHE_TTL секунд
 """
 
 import sys
@@ -65,6 +68,7 @@ def main():
     elif command == "remove":
         if db.set_admin(user_id, False):
             print(f"[OK] User ID: {user_id} admin status removed")
+            print(f"   (running bot applies it within {Database.USER_CACHE_TTL} s)")
         else:
             print(f"[ERROR] Failed to remove admin")
     
@@ -0,0 +1,259 @@
+import asyncio
+import copy
+import json
+import logging
+import sqlite3
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+from aiogram.dispatcher.storage import BaseStorage
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище состояний FSM aiogram в SQLite, которое переживает перезапуск бота.
+    
+    Рабочая копия состояний держится в памяти, поэтому чтения не обращаются к БД.
+    Изменения записываются пачками раз в flush_interval секунд в отдельном потоке
+    (и при close()); без изменений фоновая запись не просыпается. Сессии, которые
+    не менялись дольше ttl секунд (брошенная регистрация), удаляются из памяти и из БД.
+    """
+    
+    SESSION_TTL = 24 * 3600
+    FLUSH_INTERVAL = 1.0
+    SWEEP_INTERVAL = 600
+    
+    def __init__(self, db_file: str = "fsm_storage.db", ttl: float = SESSION_TTL,
+                 flush_interval: float = FLUSH_INTERVAL):
+        self.db_file = db_file
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        # Все обращения к соединению идут через один поток
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-storage")
+        self._conn = self._executor.submit(self._connect).result()
+        # (chat, user) -> {"state", "data", "bucket", "updated_at"}
+        self._records = self._executor.submit(self._load).result()
+        self._dirty = set()
+        self._flush_task = None
+        self._last_sweep = time.monotonic()
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS fsm_storage (
+            chat TEXT NOT NULL,
+            user TEXT NOT NULL,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            bucket TEXT NOT NULL DEFAULT '{}',
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (chat, user)
+        )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated ON fsm_storage(updated_at)")
+        conn.commit()
+        return conn
+    
+    def _load(self) -> dict:
+        """Удаляет просроченные сессии и загружает остальные"""
+        self._conn.execute("DELETE FROM fsm_storage WHERE updated_at < ?", (time.time() - self.ttl,))
+        self._conn.commit()
+        records = {}
+        for chat, user, state, data, bucket, updated_at in self._conn.execute(
+            "SELECT chat, user, state, data, bucket, updated_at FROM fsm_storage"
+        ):
+            try:
+                records[(chat, user)] = {
+                    "state": state,
+                    "data": json.loads(data),
+                    "bucket": json.loads(bucket),
+                    "updated_at": updated_at
+                }
+            except ValueError as e:
+                logging.error(f"Повреждённая сессия FSM chat={chat}, user={user}: {e}")
+        logging.info(f"Загружено сессий FSM: {len(records)}")
+        return records
+    
+    def _key(self, chat, user) -> tuple:
+        return tuple(map(str, self.check_address(chat=chat, user=user)))
+    
+    def _record(self, chat, user) -> dict:
+        """Запись сессии для изменения (создаётся при отсутствии); изменение попадёт в ближайшую запись в БД"""
+        key = self._key(chat, user)
+        record = self._records.get(key)
+        if record is None:
+            record = {"state": None, "data": {}, "bucket": {}}
+            self._records[key] = record
+        record["updated_at"] = time.time()
+        self._dirty.add(key)
+        self._schedule_flush()
+        return record
+    
+    def _cleanup(self, chat, user):
+        """Удаляет пустую сессию (из БД она удалится при ближайшей записи)"""
+        key = self._key(chat, user)
+        record = self._records.get(key)
+        if record and record["state"] is None and not record["data"] and not record["bucket"]:
+            del self._records[key]
+    
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop())
+    
+    async def _flush_loop(self):
+        """
+        Периодически записывает изменения в БД и удаляет просроченные сессии.
+        Когда записывать нечего, цикл завершается; следующее изменение запустит его снова
+        """
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() - self._last_sweep > self.SWEEP_INTERVAL:
+                    await self.expire()
+            except Exception as e:
+                logging.error(f"Ошибка при записи состояний FSM: {e}", exc_info=True)
+            if not self._dirty:
+                break
+    
+    async def flush(self):
+        """Записывает в БД все изменённые с прошлой записи сессии одной транзакцией"""
+        if not self._dirty:
+            return
+        
+        keys, self._dirty = self._dirty, set()
+        rows, deleted = [], []
+        for key in keys:
+            record = self._records.get(key)
+            if record is None:
+                deleted.append(key)
+                continue
+            try:
+                rows.append((*key, record["state"], json.dumps(record["data"]),
+                             json.dumps(record["bucket"]), record["updated_at"]))
+            except (TypeError, ValueError) as e:
+                logging.error(f"Сессия FSM {key} не сериализуется в JSON и не будет сохранена: {e}")
+        
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self._write, rows, deleted)
+        except Exception:
+            # Повторим при следующей записи, если сессии с тех пор не изменились
+            self._dirty |= keys
+            raise
+    
+    def _write(self, rows: list, deleted: list):
+        try:
+            self._conn.executemany("""
+            INSERT OR REPLACE INTO fsm_storage (chat, user, state, data, bucket, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """, rows)
+            self._conn.executemany("DELETE FROM fsm_storage WHERE chat = ? AND user = ?", deleted)
+            self._conn.commit()
+        except Exception:
+            self._conn.rollback()
+            raise
+    
+    async def expire(self) -> int:
+        """Удаляет сессии, не менявшиеся дольше ttl, и возвращает их количество"""
+        self._last_sweep = time.monotonic()
+        deadline = time.time() - self.ttl
+        expired = [key for key, record in self._records.items() if record["updated_at"] < deadline]
+        for key in expired:
+            del self._records[key]
+            self._dirty.discard(key)
+        
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._delete_expired, deadline)
+        if expired:
+            logging.info(f"Удалено просроченных сессий FSM: {len(expired)}")
+        return len(expired)
+    
+    def _delete_expired(self, deadline: float):
+        self._conn.execute("DELETE FROM fsm_storage WHERE updated_at < ?", (deadline,))
+        self._conn.commit()
+    
+    async def close(self):
+        """Записывает несохранённые изменения и закрывает соединение"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        try:
+            await self.flush()
+        finally:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._executor, self._conn.close)
+            self._executor.shutdown(wait=True)
+    
+    async def wait_closed(self):
+        pass
+    
+    async def get_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        record = self._records.get(self._key(chat, user))
+        if record is None:
+            return self.resolve_state(default)
+        return record["state"]
+    
+    async def get_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[dict] = None) -> typing.Dict:
+        record = self._records.get(self._key(chat, user))
+        if record is None:
+            return copy.deepcopy(default) if default else {}
+        return copy.deepcopy(record["data"])
+    
+    async def set_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.AnyStr = None):
+        self._record(chat, user)["state"] = self.resolve_state(state)
+        self._cleanup(chat, user)
+    
+    async def set_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        self._record(chat, user)["data"] = copy.deepcopy(data) if data else {}
+        self._cleanup(chat, user)
+    
+    async def update_data(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None,
+                          **kwargs):
+        self._record(chat, user)["data"].update(copy.deepcopy(data or {}), **kwargs)
+        self._cleanup(chat, user)
+    
+    def has_bucket(self):
+        return True
+    
+    async def get_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         default: typing.Optional[dict] = None) -> typing.Dict:
+        record = self._records.get(self._key(chat, user))
+        if record is None:
+            return copy.deepcopy(default) if default else {}
+        return copy.deepcopy(record["bucket"])
+    
+    async def set_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         bucket: typing.Dict = None):
+        self._record(chat, user)["bucket"] = copy.deepcopy(bucket) if bucket else {}
+        self._cleanup(chat, user)
+    
+    async def update_bucket(self, *,
+                            chat: typing.Union[str, int, None] = None,
+                            user: typing.Union[str, int, None] = None,
+                            bucket: typing.Dict = None,
+                            **kwargs):
+        self._record(chat, user)["bucket"].update(copy.deepcopy(bucket or {}), **kwargs)
+        self._cleanup(chat, user)
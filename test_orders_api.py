@@ -71,10 +71,6 @@ async def test_orders():
         except Exception as e:
             print(f"❌ ИСКЛЮЧЕНИЕ: {e}")
             logging.exception(e)
-        
-        # Задержка между запросами
-        if idx < len(users):
-            await asyncio.sleep(2)
     
     print(f"\n{'='*80}")
     print("ТЕСТ ЗАВЕРШЕН")
@@ -103,6 +99,8 @@ async def test_orders():
             print(f"  {name or 'Без имени':30} | {phone:15} | Заказов: {orders}")
     
     print("-" * 80)
+    
+    await yandex_api.close()
 
 if __name__ == "__main__":
     asyncio.run(test_orders())
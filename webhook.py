@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import signal
+from typing import Optional
+from urllib.parse import urlsplit
+
+from aiogram import Bot, Dispatcher, types
+from aiohttp import web
+
+# Заголовок, в котором Telegram передаёт secret_token из setWebhook
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def check_webhook_url(url: str):
+    """
+    Проверяет адрес для setWebhook: Telegram принимает только HTTPS, а пустой адрес
+    удаляет webhook - сервер ждал бы обновлений, которые никогда не придут
+    
+    Raises:
+        ValueError: адрес пустой или не HTTPS
+    """
+    if not url:
+        raise ValueError("WEBHOOK_URL не задан (нужен публичный HTTPS-адрес, например https://example.com/webhook)")
+    parts = urlsplit(url)
+    if parts.scheme != "https" or not parts.netloc:
+        raise ValueError(f"WEBHOOK_URL должен быть HTTPS-адресом, получено: {url}")
+
+
+class WebhookServer:
+    """
+    Приём обновлений Telegram через webhook на aiohttp (альтернатива long polling).
+    
+    POST на path подтверждается сразу, а обновление обрабатывается в отдельной задаче,
+    поэтому медленный обработчик не задерживает ответ Telegram и следующие обновления.
+    GET /health отдаёт состояние сервера для мониторинга. При остановке сервер перестаёт
+    принимать обновления (503 - Telegram доставит их повторно после перезапуска) и ждёт
+    завершения уже начатых обработчиков не дольше drain_timeout секунд.
+    """
+    
+    DRAIN_TIMEOUT = 30
+    
+    def __init__(self, dp: Dispatcher, path: str = "/webhook", secret: Optional[str] = None,
+                 drain_timeout: float = DRAIN_TIMEOUT):
+        self.dp = dp
+        self.path = path
+        self.secret = secret
+        self.drain_timeout = drain_timeout
+        self.processed = 0
+        self.failed = 0
+        self._tasks = set()
+        self._accepting = False
+        self._runner = None
+        
+        self.app = web.Application()
+        self.app.router.add_post(path, self.handle_update)
+        self.app.router.add_get("/health", self.handle_health)
+    
+    async def handle_update(self, request: web.Request) -> web.Response:
+        """Принимает обновление и запускает его обработку в фоне"""
+        if self.secret and request.headers.get(SECRET_HEADER) != self.secret:
+            return web.Response(status=403)
+        if not self._accepting:
+            return web.Response(status=503)
+        
+        try:
+            update = types.Update(**await request.json())
+        except (ValueError, TypeError):
+            return web.Response(status=400)
+        
+        # Обработчики берут бота и диспетчер из контекста, задача наследует его
+        Bot.set_current(self.dp.bot)
+        Dispatcher.set_current(self.dp)
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+    
+    async def _process(self, update: types.Update):
+        try:
+            await self.dp.process_update(update)
+            self.processed += 1
+        except Exception as e:
+            self.failed += 1
+            logging.error(f"Ошибка при обработке обновления {update.update_id}: {e}", exc_info=True)
+    
+    async def handle_health(self, request: web.Request) -> web.Response:
+        """Состояние сервера: принимает ли обновления и сколько их в обработке"""
+        return web.json_response({
+            "status": "ok" if self._accepting else "draining",
+            "in_flight": len(self._tasks),
+            "processed": self.processed,
+            "failed": self.failed
+        }, status=200 if self._accepting else 503)
+    
+    async def start(self, host: str, port: int):
+        """Запускает веб-сервер (без регистрации webhook в Telegram)"""
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self._accepting = True
+        logging.info(f"Webhook-сервер слушает http://{host}:{port}{self.path}")
+    
+    async def stop(self):
+        """Перестаёт принимать обновления, дожидается начатых обработчиков и останавливает сервер"""
+        self._accepting = False
+        if self._tasks:
+            logging.info(f"Ожидание завершения обработчиков: {len(self._tasks)}")
+            _, pending = await asyncio.wait(set(self._tasks), timeout=self.drain_timeout)
+            if pending:
+                logging.warning(f"Не завершились за {self.drain_timeout} с обработчиков: {len(pending)}")
+                for task in pending:
+                    task.cancel()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+    
+    async def run(self, host: str, port: int, url: str):
+        """Запускает сервер, регистрирует webhook и работает до SIGINT/SIGTERM"""
+        check_webhook_url(url)
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+        
+        await self.start(host, port)
+        try:
+            # Обновления, пришедшие во время перезапуска, Telegram держит в очереди и доставит сюда
+            await self.dp.bot.set_webhook(url, secret_token=self.secret or None)
+            logging.info(f"Webhook зарегистрирован: {url}")
+            await stop_event.wait()
+            logging.info("Остановка webhook-сервера...")
+        finally:
+            await self.stop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(sig)
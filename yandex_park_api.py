@@ -2,15 +2,169 @@ import aiohttp
 import asyncio
 import logging
 import json
+import random
+import time
 from datetime import datetime, timedelta
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Tuple
+from cache import TTLCache
+
+class RateLimiter:
+    """
+    Адаптивный token bucket: в среднем не больше rate запросов в секунду, всплеском до burst.
+    
+    Темп подстраивается по AIMD: после каждого успешного ответа растёт на increase_step
+    (до max_rate), при 429 падает в 1/decrease_factor раз (до min_rate). Retry-After
+    приостанавливает выдачу токенов всем ожидающим.
+    """
+    
+    def __init__(self, rate: float, burst: int = 1, max_rate: Optional[float] = None, min_rate: float = 0.2,
+                 increase_step: float = 0.05, decrease_factor: float = 0.5):
+        self.rate = rate
+        self.burst = burst
+        self.max_rate = max(rate, max_rate or rate)
+        self.min_rate = min(rate, min_rate)
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease_at = 0.0
+    
+    async def acquire(self):
+        """Ждёт свободный токен и забирает его"""
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+    
+    def on_success(self):
+        """Аддитивно увеличивает темп после успешного ответа"""
+        self.rate = min(self.max_rate, self.rate + self.increase_step)
+    
+    def on_throttle(self, retry_after: Optional[float] = None):
+        """Реакция на 429: мультипликативно снижает темп и ставит паузу"""
+        now = time.monotonic()
+        # Пачка 429 от запросов, ушедших одновременно, - это одно событие, темп снижаем один раз
+        if now - self._last_decrease_at >= 1.0:
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            self._last_decrease_at = now
+        self._tokens = 0.0
+        self._updated_at = now
+        pause = retry_after if retry_after is not None else 1.0 / self.rate
+        self._paused_until = max(self._paused_until, now + pause)
+
+
+class FleetAPIUnavailable(Exception):
+    """Fleet API считается недоступным (circuit breaker разомкнут), запрос не отправлялся"""
+
+
+class CircuitBreaker:
+    """
+    Размыкается после failure_threshold подряд неудачных запросов (5xx, таймауты, обрывы
+    соединения) и reset_timeout секунд отклоняет запросы сразу. Затем пропускает один
+    пробный запрос: успех замыкает цепь, неудача размыкает её снова.
+    """
+    
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight = False
+    
+    @property
+    def is_open(self) -> bool:
+        """Отклоняются ли сейчас запросы без попытки"""
+        if self._opened_at is None:
+            return False
+        return self._probe_in_flight or time.monotonic() - self._opened_at < self.reset_timeout
+    
+    def allow_request(self) -> Tuple[bool, bool]:
+        """
+        Можно ли отправить запрос. Возвращает (разрешён, пробный): в полуоткрытом состоянии
+        пропускает ровно один пробный запрос, и только его исход передаётся с probe=True
+        """
+        if self._opened_at is None:
+            return True, False
+        if self.is_open:
+            return False, False
+        self._probe_in_flight = True
+        return True, True
+    
+    def release_probe(self):
+        """Снимает пробный запрос без вывода (например, его отменили)"""
+        self._probe_in_flight = False
+    
+    def record_success(self, probe: bool = False):
+        if self._opened_at is not None:
+            logging.info("[CIRCUIT] Fleet API снова отвечает, цепь замкнута")
+        self._failures = 0
+        self._opened_at = None
+        if probe:
+            self._probe_in_flight = False
+    
+    def record_failure(self, probe: bool = False):
+        """
+        Учитывает неудачный запрос. Неудача пробного запроса снова размыкает цепь; неудача
+        запроса, начатого до размыкания, пробу не снимает
+        """
+        self._failures += 1
+        if probe or (self._opened_at is None and self._failures >= self.failure_threshold):
+            logging.error(f"[CIRCUIT] Fleet API недоступен ({self._failures} ошибок подряд), "
+                          f"запросы отклоняются {self.reset_timeout:.0f} с")
+            self._opened_at = time.monotonic()
+        if probe:
+            self._probe_in_flight = False
+
 
 class YandexParkAPI:
-    """Класс для работы с API Яндекс Парка"""
+    """
+    Класс для работы с API Яндекс Парка.
+    
+    Держит одну долгоживущую HTTP-сессию с пулом keep-alive соединений,
+    поэтому объект нужно закрывать: `await api.close()` или `async with YandexParkAPI(...) as api`.
+    """
     
     BASE_URL = "https://fleet-api.taxi.yandex.net"
     
-    def __init__(self, park_id: str, api_key: str, client_id: str):
+    # Параметры пула соединений
+    CONNECTION_LIMIT = 20  # Максимум одновременных соединений с Fleet API
+    DNS_CACHE_TTL = 300  # Кэш DNS, секунд
+    KEEPALIVE_TIMEOUT = 60  # Сколько держать простаивающее соединение, секунд
+    REQUEST_TIMEOUT = 30  # Таймаут запроса по умолчанию, секунд
+    RATE_LIMIT_RPS = 3.0  # Начальный темп запросов в секунду (общий лимит на все вызовы клиента)
+    RATE_LIMIT_MAX_RPS = 10.0  # Выше этого темп не разгоняется даже без 429
+    MAX_RETRIES = 3  # Сколько раз повторять запрос после 429, 5xx, таймаута или обрыва соединения
+    RETRY_BACKOFF_BASE = 0.5  # Базовая задержка экспоненциального backoff, секунд
+    RETRY_BACKOFF_MAX = 10.0  # Потолок задержки между повторами, секунд
+    CIRCUIT_FAILURE_THRESHOLD = 5  # Неудачных запросов подряд до размыкания circuit breaker
+    CIRCUIT_RESET_TIMEOUT = 60.0  # Сколько секунд отклонять запросы после размыкания
+    
+    BULK_MAX_PAGES = 200  # Предел страниц при выгрузке заказов всего парка
+    
+    # Кэш результатов: сколько записей держать и сколько секунд они живут
+    ORDERS_CACHE_SIZE = 5000
+    ORDERS_CACHE_TTL = 3600
+    
+    # Параметры локального справочника водителей (поиск по телефону)
+    ROSTER_PAGE_SIZE = 1000  # Водителей на страницу при выгрузке driver-profiles/list
+    ROSTER_TTL = 600  # Через сколько секунд справочник обновляется в фоне
+    ROSTER_MISS_REFRESH_INTERVAL = 60  # Как часто неудачный точечный поиск может форсировать полное обновление
+    ROSTER_FIELDS = {
+        "driver_profile": ["id", "phones", "first_name", "last_name", "middle_name", "work_status"],
+        "account": ["balance", "balance_limit"],
+        "car": ["brand", "model", "normalized_number", "amenities", "year", "cargo_type"]
+    }
+    
+    def __init__(self, park_id: str, api_key: str, client_id: str, requests_per_second: float = RATE_LIMIT_RPS,
+                 max_requests_per_second: float = RATE_LIMIT_MAX_RPS):
         self.park_id = park_id
         self.api_key = api_key
         self.client_id = client_id
@@ -20,10 +174,188 @@ class YandexParkAPI:
             "X-API-Key": api_key,
             "Accept-Language": "ru"
         }
+        # Сессия создаётся лениво внутри работающего event loop
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.circuit_breaker = CircuitBreaker(self.CIRCUIT_FAILURE_THRESHOLD, self.CIRCUIT_RESET_TIMEOUT)
+        # Все запросы клиента проходят через один лимитер
+        self.rate_limiter = RateLimiter(
+            requests_per_second,
+            burst=max(1, int(requests_per_second)),
+            max_rate=max_requests_per_second
+        )
+        
+        # Справочник водителей: нормализованный телефон -> driver_id и driver_id -> профиль
+        self._roster_phones: Dict[str, str] = {}
+        self._roster_drivers: Dict[str, Dict] = {}
+        self._roster_updated_at = 0.0  # time.monotonic() последнего успешного обновления
+        self._roster_task: Optional[asyncio.Task] = None
+        
+        # Запросы, которые сейчас выполняются: (метод, аргументы) -> задача
+        self._in_flight: Dict[tuple, asyncio.Future] = {}
+        
+        # Последние полученные значения: driver_id -> количество заказов (позиции водителей хранит БД)
+        self._orders_cache = TTLCache(self.ORDERS_CACHE_SIZE, self.ORDERS_CACHE_TTL)
+    
+    async def __aenter__(self):
+        await self.start()
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+    
+    async def start(self):
+        """Заранее открывает HTTP-сессию (необязательно, сессия создаётся при первом запросе)"""
+        self._get_session()
+        return self
+    
+    async def close(self):
+        """Закрывает HTTP-сессию и все соединения пула"""
+        if self._roster_task is not None and not self._roster_task.done():
+            self._roster_task.cancel()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Возвращает общую сессию, создавая её при необходимости"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.CONNECTION_LIMIT,
+                ttl_dns_cache=self.DNS_CACHE_TTL,
+                keepalive_timeout=self.KEEPALIVE_TIMEOUT
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers=self.headers,
+                timeout=aiohttp.ClientTimeout(total=self.REQUEST_TIMEOUT)
+            )
+        return self._session
+    
+    async def _request(self, path: str, payload: Dict, timeout: Optional[float] = None) -> Tuple[int, str]:
+        """
+        Выполняет POST-запрос к Fleet API через общую сессию
+        
+        Args:
+            path: Путь метода API, например /v1/parks/orders/list
+            payload: Тело запроса
+            timeout: Таймаут запроса в секундах (по умолчанию REQUEST_TIMEOUT)
+        
+        Returns:
+            Кортеж (HTTP-статус, текст ответа)
+        
+        Все методы Fleet API, которые использует клиент, - чтения, поэтому запрос можно
+        безопасно повторять: при 429 (после паузы лимитера), 5xx, таймауте и обрыве
+        соединения выполняется до MAX_RETRIES повторов с экспоненциальным backoff и jitter.
+        
+        Raises:
+            FleetAPIUnavailable: circuit breaker разомкнут, запрос не отправлялся
+            asyncio.TimeoutError, aiohttp.ClientError: если не помогли и повторы
+        """
+        allowed, probe = self.circuit_breaker.allow_request()
+        if not allowed:
+            raise FleetAPIUnavailable(f"Fleet API недоступен, запрос {path} отклонён")
+        
+        session = self._get_session()
+        kwargs = {}
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+        
+        try:
+            attempt = 0
+            while True:
+                await self.rate_limiter.acquire()
+                try:
+                    async with session.post(f"{self.BASE_URL}{path}", json=payload, **kwargs) as response:
+                        status, text = response.status, await response.text()
+                        retry_after = response.headers.get("Retry-After")
+                except (asyncio.TimeoutError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError) as e:
+                    if attempt >= self.MAX_RETRIES:
+                        self.circuit_breaker.record_failure(probe)
+                        raise
+                    attempt += 1
+                    delay = self._backoff_delay(attempt)
+                    logging.warning(f"[RETRY] {path}: {type(e).__name__} {e}, повтор {attempt}/{self.MAX_RETRIES} через {delay:.1f} с")
+                    await asyncio.sleep(delay)
+                    continue
+                
+                if status == 429:
+                    self.rate_limiter.on_throttle(self._parse_retry_after(retry_after))
+                    if attempt >= self.MAX_RETRIES:
+                        # Лимит - не признак недоступности API, цепь не трогаем
+                        self.circuit_breaker.record_success(probe)
+                        return status, text
+                    attempt += 1
+                    logging.warning(f"[RATE_LIMIT] 429 на {path}, снижаем темп до {self.rate_limiter.rate:.2f} запр/с, "
+                                    f"повтор {attempt}/{self.MAX_RETRIES}")
+                    continue
+                
+                if status >= 500:
+                    if attempt >= self.MAX_RETRIES:
+                        self.circuit_breaker.record_failure(probe)
+                        return status, text
+                    attempt += 1
+                    delay = self._backoff_delay(attempt)
+                    logging.warning(f"[RETRY] {path}: HTTP {status}, повтор {attempt}/{self.MAX_RETRIES} через {delay:.1f} с")
+                    await asyncio.sleep(delay)
+                    continue
+            
+                self.rate_limiter.on_success()
+                self.circuit_breaker.record_success(probe)
+                return status, text
+        except BaseException:
+            # Отмена или неожиданная ошибка пробного запроса не должны оставить цепь в полуоткрытом
+            # состоянии; пробу снимает только сам пробный запрос
+            if probe:
+                self.circuit_breaker.release_probe()
+            raise
+    
+    def invalidate_orders_count(self, driver_id: str):
+        """Сбрасывает закэшированное количество заказов водителя"""
+        self._orders_cache.invalidate(str(driver_id).strip())
+    
+    async def _single_flight(self, key: tuple, factory):
+        """
+        Объединяет одновременные одинаковые вызовы: пока запрос с ключом key выполняется,
+        остальные вызывающие ждут его результат, а не запускают такой же запрос заново
+        """
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            logging.debug(f"[SINGLE_FLIGHT] Присоединяемся к выполняющемуся запросу {key}")
+        # shield: отмена одного ожидающего (например, по таймауту) не отменяет запрос для остальных
+        return await asyncio.shield(task)
+    
+    def _backoff_delay(self, attempt: int) -> float:
+        """Экспоненциальная задержка перед повтором с полным jitter"""
+        return random.uniform(0, min(self.RETRY_BACKOFF_MAX, self.RETRY_BACKOFF_BASE * 2 ** attempt))
+    
+    @staticmethod
+    def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """Разбирает заголовок Retry-After (секунды или HTTP-дата)"""
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            from email.utils import parsedate_to_datetime
+            from datetime import timezone
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
     
     async def check_driver_by_phone(self, phone: str) -> Optional[Dict]:
         """
-        Проверяет, существует ли водитель с указанным номером телефона, используя прямой запрос.
+        Проверяет, существует ли водитель с указанным номером телефона.
+        
+        Поиск идёт по локальному справочнику водителей парка (O(1) по телефону).
+        Устаревший справочник обновляется в фоне; при промахе выполняется
+        точечный запрос в API, чтобы не пропустить только что добавленного водителя.
+        Полная выгрузка справочника - только если точечный запрос не удался.
         
         Args:
             phone: Номер телефона в формате +79XXXXXXXXX
@@ -34,80 +366,183 @@ class YandexParkAPI:
         try:
             normalized_phone = self._normalize_phone(phone)
             
-            timeout = aiohttp.ClientTimeout(total=10)  # Таймаут 10 секунд
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                url = f"{self.BASE_URL}/v1/parks/driver-profiles/list"
-                
-                # Получаем список водителей и фильтруем по телефону локально
+            if not self._roster_updated_at:
+                # Справочник ещё ни разу не загружался - ждём первую выгрузку
+                error = await self.refresh_roster()
+                if error:
+                    return {"found": False, "error": error}
+            elif time.monotonic() - self._roster_updated_at > self.ROSTER_TTL:
+                # Отвечаем по текущим данным, обновление идёт в фоне
+                self.schedule_roster_refresh()
+            
+            driver = self._lookup_roster(normalized_phone)
+            if driver:
+                return self._format_driver(driver)
+            
+            # Промах: водителя могли добавить после последней выгрузки
+            driver, error = await self._find_driver_by_phone_remote(normalized_phone)
+            # Ответ без совпадения значит, что водителя нет; весь парк перечитываем, только если запрос не удался
+            if error and time.monotonic() - self._roster_updated_at > self.ROSTER_MISS_REFRESH_INTERVAL:
+                if await self.refresh_roster() is None:
+                    driver, error = self._lookup_roster(normalized_phone), None
+            if driver:
+                return self._format_driver(driver)
+            if error:
+                return {"found": False, "error": error}
+            
+            # Не нашли водителя с таким номером
+            return {"found": False}
+                        
+        except asyncio.TimeoutError:
+            logging.error("Таймаут при запросе к API Яндекс")
+            return {"found": False, "error": "timeout"}
+        except Exception as e:
+            logging.error(f"Ошибка при проверке водителя: {e}")
+            return {"found": False, "error": str(e)}
+    
+    def schedule_roster_refresh(self) -> asyncio.Task:
+        """Запускает фоновое обновление справочника водителей (не больше одного одновременно)"""
+        if self._roster_task is None or self._roster_task.done():
+            self._roster_task = asyncio.ensure_future(self._load_roster())
+        return self._roster_task
+    
+    async def refresh_roster(self) -> Optional[str]:
+        """
+        Обновляет справочник водителей и дожидается результата
+        
+        Returns:
+            None при успехе или текст ошибки
+        """
+        # shield: отмена ожидающего (например, по таймауту) не прерывает саму выгрузку
+        return await asyncio.shield(self.schedule_roster_refresh())
+    
+    async def _load_roster(self) -> Optional[str]:
+        """Выгружает всех водителей парка постранично и пересобирает индекс по телефонам"""
+        phones: Dict[str, str] = {}
+        drivers: Dict[str, Dict] = {}
+        offset = 0
+        started = time.monotonic()
+        
+        try:
+            while True:
                 payload = {
-                    "fields": {
-                        "driver_profile": ["id", "phones", "first_name", "last_name", "middle_name", "work_status"],
-                        "account": ["balance", "balance_limit"],
-                        "car": ["brand", "model", "normalized_number", "amenities", "year"]
-                    },
+                    "fields": self.ROSTER_FIELDS,
                     "query": {
                         "park": {
                             "id": self.park_id
                         }
                     },
-                    "limit": 1000  # Получаем до 1000 водителей для поиска
+                    "limit": self.ROSTER_PAGE_SIZE,
+                    "offset": offset
                 }
                 
-                try:
-                    async with session.post(url, json=payload, headers=self.headers) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            
-                            # Ищем водителя по номеру телефона в результатах
-                            driver_profiles = data.get("driver_profiles", [])
-                            
-                            for driver in driver_profiles:
-                                profile = driver.get("driver_profile", {})
-                                driver_phones = profile.get("phones", [])
-                                
-                                # Проверяем все телефоны водителя
-                                for phone_obj in driver_phones:
-                                    # phone_obj может быть строкой или объектом с полем "number"
-                                    phone_str = phone_obj if isinstance(phone_obj, str) else phone_obj.get("number", "")
-                                    if self._normalize_phone(phone_str) == normalized_phone:
-                                        # Нашли водителя с нужным номером
-                                        account = driver.get("account", {})
-                                        car = driver.get("car", {})
-                                        
-                                        return {
-                                            "found": True,
-                                            "driver_id": profile.get("id"),
-                                            "first_name": profile.get("first_name"),
-                                            "last_name": profile.get("last_name"),
-                                            "middle_name": profile.get("middle_name"),
-                                            "phones": driver_phones,
-                                            "work_status": profile.get("work_status"),
-                                            "balance": account.get("balance"),
-                                            "balance_limit": account.get("balance_limit"),
-                                            "car": {
-                                                "brand": car.get("brand"),
-                                                "model": car.get("model"),
-                                                "year": car.get("year"),
-                                                "number": car.get("normalized_number")
-                                            }
-                                        }
-                            
-                            # Не нашли водителя с таким номером
-                            return {"found": False}
-                        else:
-                            error_text = await response.text()
-                            logging.error(f"Ошибка API Яндекс: {response.status}, {error_text}")
-                            return {"found": False, "error": f"API error {response.status}"}
-                except asyncio.TimeoutError:
-                    logging.error("Таймаут при запросе к API Яндекс")
-                    return {"found": False, "error": "timeout"}
-                except Exception as e:
-                    logging.error(f"Ошибка запроса к API: {e}")
-                    return {"found": False, "error": str(e)}
-                        
+                status, response_text = await self._request("/v1/parks/driver-profiles/list", payload)
+                if status != 200:
+                    logging.error(f"[ROSTER] Ошибка API Яндекс: {status}, {response_text[:500]}")
+                    return f"API error {status}"
+                
+                data = json.loads(response_text)
+                page = data.get("driver_profiles", [])
+                for driver in page:
+                    self._index_driver(driver, phones, drivers)
+                
+                offset += len(page)
+                total = data.get("total", 0)
+                if not page or offset >= total:
+                    break
+        except asyncio.TimeoutError:
+            logging.error("[ROSTER] Таймаут при выгрузке водителей")
+            return "timeout"
         except Exception as e:
-            logging.error(f"Ошибка при проверке водителя: {e}")
-            return {"found": False, "error": str(e)}
+            logging.error(f"[ROSTER] Ошибка при выгрузке водителей: {e}")
+            return str(e)
+        
+        # Подменяем индекс целиком, чтобы читатели не видели его частично собранным
+        self._roster_phones = phones
+        self._roster_drivers = drivers
+        self._roster_updated_at = time.monotonic()
+        logging.info(f"[ROSTER] Загружено водителей: {len(drivers)}, телефонов: {len(phones)} "
+                     f"за {self._roster_updated_at - started:.1f} с")
+        return None
+    
+    async def _find_driver_by_phone_remote(self, normalized_phone: str) -> Tuple[Optional[Dict], Optional[str]]:
+        """
+        Точечный поиск водителя по телефону через текстовый фильтр API; найденного добавляет в индекс.
+        
+        Returns:
+            (водитель или None, None) - запрос выполнен; (None, описание ошибки) - запрос не удался
+        """
+        payload = {
+            "fields": self.ROSTER_FIELDS,
+            "query": {
+                "park": {
+                    "id": self.park_id
+                },
+                "text": normalized_phone
+            },
+            "limit": 100
+        }
+        
+        try:
+            status, response_text = await self._request("/v1/parks/driver-profiles/list", payload, timeout=10)
+            if status != 200:
+                logging.warning(f"[ROSTER] Точечный поиск по телефону не удался: {status}")
+                return None, f"status {status}"
+            
+            for driver in json.loads(response_text).get("driver_profiles", []):
+                self._index_driver(driver, self._roster_phones, self._roster_drivers)
+        except asyncio.TimeoutError:
+            logging.warning("[ROSTER] Таймаут точечного поиска по телефону")
+            return None, "timeout"
+        except (aiohttp.ClientError, FleetAPIUnavailable, ValueError) as e:
+            logging.warning(f"[ROSTER] Точечный поиск по телефону не удался: {e}")
+            return None, str(e)
+        
+        return self._lookup_roster(normalized_phone), None
+    
+    def _index_driver(self, driver: Dict, phones: Dict[str, str], drivers: Dict[str, Dict]):
+        """Добавляет водителя в индекс по всем его телефонам"""
+        profile = driver.get("driver_profile", {})
+        driver_id = profile.get("id")
+        if not driver_id:
+            return
+        drivers[driver_id] = driver
+        for phone_obj in profile.get("phones", []):
+            # phone_obj может быть строкой или объектом с полем "number"
+            phone_str = phone_obj if isinstance(phone_obj, str) else phone_obj.get("number", "")
+            if phone_str:
+                phones[self._normalize_phone(phone_str)] = driver_id
+    
+    def _lookup_roster(self, normalized_phone: str) -> Optional[Dict]:
+        """Ищет водителя в справочнике по нормализованному телефону"""
+        driver_id = self._roster_phones.get(normalized_phone)
+        return self._roster_drivers.get(driver_id) if driver_id else None
+    
+    @staticmethod
+    def _format_driver(driver: Dict) -> Dict:
+        """Формирует ответ check_driver_by_phone из записи driver-profiles/list"""
+        profile = driver.get("driver_profile", {})
+        account = driver.get("account", {})
+        car = driver.get("car", {})
+        
+        return {
+            "found": True,
+            "driver_id": profile.get("id"),
+            "first_name": profile.get("first_name"),
+            "last_name": profile.get("last_name"),
+            "middle_name": profile.get("middle_name"),
+            "phones": profile.get("phones", []),
+            "work_status": profile.get("work_status"),
+            "balance": account.get("balance"),
+            "balance_limit": account.get("balance_limit"),
+            "car": {
+                "brand": car.get("brand"),
+                "model": car.get("model"),
+                "year": car.get("year"),
+                "number": car.get("normalized_number"),
+                "cargo_type": car.get("cargo_type")
+            }
+        }
     
     async def get_driver_info(self, driver_id: str) -> Optional[Dict]:
         """
@@ -119,49 +554,89 @@ class YandexParkAPI:
         Returns:
             Dict с информацией о водителе или None при ошибке
         """
+        return await self._single_flight(("driver_info", driver_id), lambda: self._fetch_driver_info(driver_id))
+    
+    async def _fetch_driver_info(self, driver_id: str) -> Optional[Dict]:
+        """Запрос driver-profiles/retrieve для get_driver_info"""
         try:
-            async with aiohttp.ClientSession() as session:
-                url = f"{self.BASE_URL}/v1/parks/driver-profiles/retrieve"
-                
-                payload = {
-                    "fields": {
-                        "driver_profile": [
-                            "id", "phones", "first_name", "last_name", "middle_name",
-                            "driver_license", "work_status", "hiring_source"
-                        ],
-                        "account": ["balance", "balance_limit"]
-                    },
-                    "query": {
-                        "park": {
-                            "id": self.park_id,
-                            "driver_profile": {
-                                "id": driver_id
-                            }
+            payload = {
+                "fields": {
+                    "driver_profile": [
+                        "id", "phones", "first_name", "last_name", "middle_name",
+                        "driver_license", "work_status", "hiring_source"
+                    ],
+                    "account": ["balance", "balance_limit"]
+                },
+                "query": {
+                    "park": {
+                        "id": self.park_id,
+                        "driver_profile": {
+                            "id": driver_id
                         }
                     }
                 }
-                
-                async with session.post(url, json=payload, headers=self.headers) as response:
-                    if response.status == 200:
-                        return await response.json()
-                    else:
-                        logging.error(f"Ошибка получения информации о водителе: {response.status}")
-                        return None
+            }
+            
+            status, response_text = await self._request("/v1/parks/driver-profiles/retrieve", payload)
+            if status == 200:
+                return json.loads(response_text)
+            else:
+                logging.error(f"Ошибка получения информации о водителе: {status}")
+                return None
                         
         except Exception as e:
             logging.error(f"Ошибка при получении информации: {e}")
             return None
     
-    async def get_driver_orders_count(self, driver_id: str) -> Optional[int]:
+    async def get_driver_orders_count(self, driver_id: str, max_age: Optional[float] = None) -> Optional[int]:
         """
         Получает количество выполненных заказов водителя с пагинацией и fallback-стратегиями
         
         Args:
             driver_id: ID водителя
+            max_age: Насколько старое (в секундах) закэшированное значение устраивает вызывающего.
+                None - всегда запрашивать API
         
         Returns:
             Количество заказов или None при ошибке
         """
+        if driver_id and max_age is not None:
+            cached = self._orders_cache.get(str(driver_id).strip(), max_age=max_age)
+            if cached is not None:
+                return cached
+        stats = await self.get_driver_orders_stats(driver_id)
+        return stats["count"] if stats else None
+    
+    async def get_driver_orders_stats(self, driver_id: str, since: Optional[str] = None) -> Optional[Dict]:
+        """
+        Считает выполненные заказы водителя за всю историю или начиная с отметки since
+        
+        Args:
+            driver_id: ID водителя
+            since: ended_at последнего уже учтённого заказа (ISO 8601). Если указан,
+                считаются только заказы, завершённые строго позже этой отметки
+        
+        Returns:
+            Dict с ключами count, last_ended_at (максимальный ended_at среди учтённых
+            заказов или None) и complete (False, если история прочитана не полностью)
+            или None при ошибке
+        """
+        if driver_id:
+            driver_id = str(driver_id).strip()
+        stats = await self._single_flight(
+            ("orders_stats", driver_id, since), lambda: self._fetch_driver_orders_stats(driver_id, since)
+        )
+        if stats is not None and not since:
+            # Неполный подсчёт (fallback с лимитом, предел страниц) не кэшируем, а прежнее
+            # значение сбрасываем: его только что не удалось подтвердить
+            if stats["complete"]:
+                self._orders_cache.set(driver_id, stats["count"])
+            else:
+                self.invalidate_orders_count(driver_id)
+        return stats
+    
+    async def _fetch_driver_orders_stats(self, driver_id: str, since: Optional[str] = None) -> Optional[Dict]:
+        """Постраничный подсчёт заказов для get_driver_orders_stats"""
         try:
             if not driver_id:
                 logging.warning("get_driver_orders_count: driver_id пустой или None")
@@ -170,135 +645,240 @@ class YandexParkAPI:
             # Очищаем driver_id от пробелов
             driver_id = str(driver_id).strip()
             
-            async with aiohttp.ClientSession() as session:
-                url = f"{self.BASE_URL}/v1/parks/orders/list"
-                
+            from datetime import timezone
+            now = datetime.now(timezone.utc)
+            since_dt = self._parse_time(since) if since else None
+            if since_dt:
+                # Инкрементальный режим: только заказы после отметки
+                from_dt = since_dt
+            else:
                 # Указываем большой диапазон дат для получения ВСЕХ заказов (за 5 лет)
-                from datetime import timezone
-                now = datetime.now(timezone.utc)
-                five_years_ago = now - timedelta(days=1825)  # 5 лет для гарантии
-                
-                from_str = five_years_ago.isoformat().replace('+00:00', 'Z')
-                to_str = now.isoformat().replace('+00:00', 'Z')
+                from_dt = now - timedelta(days=1825)  # 5 лет для гарантии
+            
+            from_str = from_dt.isoformat().replace('+00:00', 'Z')
+            to_str = now.isoformat().replace('+00:00', 'Z')
+            
+            total_orders = 0
+            last_ended_at = None
+            last_ended_dt = None
+            complete = True
+            cursor = None
+            page = 1
+            
+            logging.info(f"[ORDERS_CHECK] Начинаем проверку заказов для driver_id={driver_id}, park_id={self.park_id}")
+            logging.info(f"[ORDERS_CHECK] Диапазон дат: {from_str} - {to_str}")
+            
+            # Получаем все заказы с пагинацией
+            while True:
+                payload = {
+                    "query": {
+                        "park": {
+                            "id": self.park_id,
+                            "order": {
+                                "ended_at": {
+                                    "from": from_str,
+                                    "to": to_str
+                                }
+                            },
+                            "driver_profile": {
+                                "id": driver_id
+                            }
+                        }
+                    },
+                    "limit": 500  # Максимальный лимит API - 500 заказов за запрос
+                }
                 
-                total_orders = 0
-                cursor = None
-                page = 1
+                # Добавляем cursor для пагинации (если есть)
+                if cursor:
+                    payload["cursor"] = cursor
                 
-                logging.info(f"[ORDERS_CHECK] Начинаем проверку заказов для driver_id={driver_id}, park_id={self.park_id}")
-                logging.info(f"[ORDERS_CHECK] Диапазон дат: {from_str} - {to_str}")
+                logging.info(f"[ORDERS_CHECK] Driver {driver_id}, страница {page}, payload: {json.dumps(payload, ensure_ascii=False)[:200]}")
                 
-                # Получаем все заказы с пагинацией
-                while True:
-                    payload = {
-                        "query": {
-                            "park": {
-                                "id": self.park_id,
-                                "order": {
-                                    "ended_at": {
-                                        "from": from_str,
-                                        "to": to_str
-                                    }
-                                },
-                                "driver_profile": {
-                                    "id": driver_id
-                                }
-                            }
-                        },
-                        "limit": 500  # Максимальный лимит API - 500 заказов за запрос
-                    }
-                    
-                    # Добавляем cursor для пагинации (если есть)
-                    if cursor:
-                        payload["cursor"] = cursor
+                try:
+                    status, response_text = await self._request("/v1/parks/orders/list", payload)
                     
-                    logging.info(f"[ORDERS_CHECK] Driver {driver_id}, страница {page}, payload: {json.dumps(payload, ensure_ascii=False)[:200]}")
+                    logging.info(f"[ORDERS_CHECK] Driver {driver_id}, страница {page}: HTTP {status}, длина ответа {len(response_text)}")
                     
-                    try:
-                        async with session.post(url, json=payload, headers=self.headers) as response:
-                            response_text = await response.text()
+                    if status == 200:
+                        try:
+                            data = json.loads(response_text)
+                            orders = data.get("orders", [])
                             
-                            logging.info(f"[ORDERS_CHECK] Driver {driver_id}, страница {page}: HTTP {response.status}, длина ответа {len(response_text)}")
+                            logging.info(f"[ORDERS_CHECK] Driver {driver_id}, страница {page}: получено {len(orders)} заказов из API")
                             
-                            if response.status == 200:
-                                try:
-                                    data = json.loads(response_text)
-                                    orders = data.get("orders", [])
-                                    
-                                    logging.info(f"[ORDERS_CHECK] Driver {driver_id}, страница {page}: получено {len(orders)} заказов из API")
-                                    
-                                    # Логируем структуру первого заказа для понимания формата
-                                    if page == 1 and orders:
-                                        first_order_keys = list(orders[0].keys()) if orders else []
-                                        logging.info(f"[ORDERS_CHECK] Driver {driver_id}: структура заказа (ключи): {first_order_keys}")
-                                        if orders:
-                                            statuses = [o.get("status") for o in orders[:5]]
-                                            logging.info(f"[ORDERS_CHECK] Driver {driver_id}: примеры статусов: {statuses}")
-                                    
-                                    if len(orders) == 0:
-                                        if page == 1:
-                                            logging.warning(f"[ORDERS_CHECK] Driver {driver_id}: API вернул пустой массив заказов на первой странице!")
-                                            logging.warning(f"[ORDERS_CHECK] Полный ответ API: {response_text[:1000]}")
-                                        break
-                                    
-                                    # Считаем ВСЕ заказы, так как API должен возвращать только завершенные
-                                    # Но на всякий случай исключаем cancelled
-                                    completed = [o for o in orders if o.get("status") != "cancelled"]
-                                    
-                                    page_count = len(completed)
-                                    total_orders += page_count
-                                    
-                                    logging.info(f"[ORDERS_CHECK] Driver {driver_id}, страница {page}: учтено {page_count} заказов (всего {len(orders)}), общий счетчик: {total_orders}")
-                                    
-                                    # Проверяем, есть ли следующая страница
-                                    cursor = data.get("cursor")
-                                    if not cursor or len(orders) < 500:
-                                        logging.info(f"[ORDERS_CHECK] Driver {driver_id}: это последняя страница (cursor={cursor}, orders={len(orders)})")
-                                        break
-                                    
-                                    page += 1
-                                    
-                                    # Защита от бесконечного цикла
-                                    if page > 50:
-                                        logging.warning(f"[ORDERS_CHECK] Driver {driver_id}: достигнут лимит страниц (50), прерываем. Текущий счетчик: {total_orders}")
-                                        break
-                                    
-                                    # Небольшая задержка между запросами
-                                    await asyncio.sleep(0.3)
-                                    
-                                except json.JSONDecodeError as json_error:
-                                    logging.error(f"[ORDERS_CHECK] Driver {driver_id}: ошибка парсинга JSON: {json_error}, ответ: {response_text[:500]}")
-                                    return total_orders if total_orders > 0 else None
-                            else:
-                                logging.error(f"[ORDERS_CHECK] Driver {driver_id}, страница {page}: HTTP {response.status}, ошибка: {response_text[:1000]}")
-                                # Если это не первая страница, возвращаем то что есть
-                                if page > 1:
-                                    return total_orders
-                                # Если первая страница с ошибкой - пробуем fallback
-                                return await self._get_orders_count_fallback(session, driver_id)
-                    
-                    except aiohttp.ClientError as client_error:
-                        logging.error(f"[ORDERS_CHECK] Driver {driver_id}: ошибка HTTP клиента: {client_error}")
-                        if page > 1:
-                            return total_orders
-                        return None
+                            # Логируем структуру первого заказа для понимания формата
+                            if page == 1 and orders:
+                                first_order_keys = list(orders[0].keys()) if orders else []
+                                logging.info(f"[ORDERS_CHECK] Driver {driver_id}: структура заказа (ключи): {first_order_keys}")
+                                if orders:
+                                    statuses = [o.get("status") for o in orders[:5]]
+                                    logging.info(f"[ORDERS_CHECK] Driver {driver_id}: примеры статусов: {statuses}")
+                            
+                            if len(orders) == 0:
+                                if page == 1 and not since_dt:
+                                    logging.warning(f"[ORDERS_CHECK] Driver {driver_id}: API вернул пустой массив заказов на первой странице!")
+                                    logging.warning(f"[ORDERS_CHECK] Полный ответ API: {response_text[:1000]}")
+                                break
+                            
+                            # Считаем ВСЕ заказы, так как API должен возвращать только завершенные
+                            # Но на всякий случай исключаем cancelled
+                            page_count = 0
+                            for order in orders:
+                                if order.get("status") == "cancelled":
+                                    continue
+                                ended_dt = self._parse_time(order.get("ended_at"))
+                                # Граница from включительная - заказ на самой отметке уже учтён
+                                if since_dt and ended_dt and ended_dt <= since_dt:
+                                    continue
+                                page_count += 1
+                                if ended_dt and (last_ended_dt is None or ended_dt > last_ended_dt):
+                                    last_ended_dt = ended_dt
+                                    last_ended_at = order.get("ended_at")
+                            
+                            total_orders += page_count
+                            
+                            logging.info(f"[ORDERS_CHECK] Driver {driver_id}, страница {page}: учтено {page_count} заказов (всего {len(orders)}), общий счетчик: {total_orders}")
+                            
+                            # Проверяем, есть ли следующая страница
+                            cursor = data.get("cursor")
+                            if not cursor or len(orders) < 500:
+                                logging.info(f"[ORDERS_CHECK] Driver {driver_id}: это последняя страница (cursor={cursor}, orders={len(orders)})")
+                                break
+                            
+                            page += 1
+                            
+                            # Защита от бесконечного цикла
+                            if page > 50:
+                                logging.warning(f"[ORDERS_CHECK] Driver {driver_id}: достигнут лимит страниц (50), прерываем. Текущий счетчик: {total_orders}")
+                                complete = False
+                                break
+                            
+                        except json.JSONDecodeError as json_error:
+                            # Частичный счётчик записался бы в БД как истинный - не возвращаем его
+                            logging.error(f"[ORDERS_CHECK] Driver {driver_id}: ошибка парсинга JSON: {json_error}, ответ: {response_text[:500]}")
+                            return None
+                    else:
+                        logging.error(f"[ORDERS_CHECK] Driver {driver_id}, страница {page}: HTTP {status}, ошибка: {response_text[:1000]}")
+                        # Ошибка после повторов (429/5xx) или на второй и дальше странице:
+                        # частичный счётчик не возвращаем, fallback на недоступном API бесполезен
+                        if page > 1 or since_dt or status == 429 or status >= 500:
+                            return None
+                        # Первая страница отклонена запросом (4xx) - пробуем fallback через booked_at
+                        count = await self._get_orders_count_fallback(driver_id)
+                        if count is None:
+                            return None
+                        return {"count": count, "last_ended_at": None, "complete": False}
                 
-                logging.info(f"[ORDERS_CHECK] Driver {driver_id}: ИТОГО заказов = {total_orders}")
-                return total_orders
-                        
+                except (aiohttp.ClientError, asyncio.TimeoutError) as client_error:
+                    logging.error(f"[ORDERS_CHECK] Driver {driver_id}: ошибка HTTP клиента: {client_error!r}")
+                    return None
+            
+            logging.info(f"[ORDERS_CHECK] Driver {driver_id}: ИТОГО заказов = {total_orders}")
+            return {"count": total_orders, "last_ended_at": last_ended_at, "complete": complete}
+        
+        except FleetAPIUnavailable as e:
+            logging.warning(f"[ORDERS_CHECK] Driver {driver_id}: {e}")
+            return None
         except Exception as e:
             logging.error(f"[ORDERS_CHECK] Ошибка при получении заказов для {driver_id}: {e}", exc_info=True)
             return None
     
-    async def _get_orders_count_fallback(self, session: aiohttp.ClientSession, driver_id: str) -> Optional[int]:
+    async def get_park_orders_stats(self, watermarks: Dict[str, Optional[str]], since: datetime) -> Optional[Dict[str, Dict]]:
+        """
+        Считает новые заказы сразу для многих водителей одним проходом по заказам парка
+        
+        Заказы парка за окно [since, сейчас] читаются постранично без фильтра по водителю
+        и сразу раскладываются по driver_id, страницы в памяти не накапливаются.
+        
+        Args:
+            watermarks: driver_id -> ended_at последнего учтённого заказа (или None).
+                Для каждого водителя считаются только заказы строго после его отметки
+            since: Начало окна выгрузки
+        
+        Returns:
+            Dict driver_id -> {"count", "last_ended_at"} для каждого переданного водителя
+            или None, если окно не удалось прочитать целиком
+        """
+        from datetime import timezone
+        now = datetime.now(timezone.utc)
+        from_str = since.astimezone(timezone.utc).isoformat().replace('+00:00', 'Z')
+        to_str = now.isoformat().replace('+00:00', 'Z')
+        
+        since_by_driver = {driver_id: self._parse_time(mark) for driver_id, mark in watermarks.items()}
+        result = {driver_id: {"count": 0, "last_ended_at": None} for driver_id in watermarks}
+        last_ended_dt: Dict[str, datetime] = {}
+        cursor = None
+        seen_orders = 0
+        
+        logging.info(f"[ORDERS_BULK] Выгрузка заказов парка {from_str} - {to_str} для {len(watermarks)} водителей")
+        
+        try:
+            for page in range(1, self.BULK_MAX_PAGES + 1):
+                payload = {
+                    "query": {
+                        "park": {
+                            "id": self.park_id,
+                            "order": {
+                                "ended_at": {
+                                    "from": from_str,
+                                    "to": to_str
+                                }
+                            }
+                        }
+                    },
+                    "limit": 500
+                }
+                if cursor:
+                    payload["cursor"] = cursor
+                
+                status, response_text = await self._request("/v1/parks/orders/list", payload)
+                if status != 200:
+                    logging.error(f"[ORDERS_BULK] Страница {page}: HTTP {status}, ошибка: {response_text[:500]}")
+                    return None
+                
+                data = json.loads(response_text)
+                orders = data.get("orders", [])
+                seen_orders += len(orders)
+                
+                for order in orders:
+                    if order.get("status") == "cancelled":
+                        continue
+                    driver_id = (order.get("driver_profile") or {}).get("id")
+                    if driver_id not in result:
+                        continue
+                    ended_dt = self._parse_time(order.get("ended_at"))
+                    driver_since = since_by_driver[driver_id]
+                    if driver_since and ended_dt and ended_dt <= driver_since:
+                        continue
+                    result[driver_id]["count"] += 1
+                    if ended_dt and (driver_id not in last_ended_dt or ended_dt > last_ended_dt[driver_id]):
+                        last_ended_dt[driver_id] = ended_dt
+                        result[driver_id]["last_ended_at"] = order.get("ended_at")
+                
+                cursor = data.get("cursor")
+                if not orders or not cursor or len(orders) < 500:
+                    break
+            else:
+                logging.warning(f"[ORDERS_BULK] Достигнут лимит страниц ({self.BULK_MAX_PAGES}), окно прочитано не полностью")
+                return None
+        except FleetAPIUnavailable as e:
+            logging.warning(f"[ORDERS_BULK] {e}")
+            return None
+        except Exception as e:
+            logging.error(f"[ORDERS_BULK] Ошибка при выгрузке заказов парка: {e}", exc_info=True)
+            return None
+        
+        logging.info(f"[ORDERS_BULK] Просмотрено заказов парка: {seen_orders}, "
+                     f"водителей с новыми заказами: {sum(1 for r in result.values() if r['count'])}")
+        return result
+    
+    async def _get_orders_count_fallback(self, driver_id: str) -> Optional[int]:
         """
         Fallback-метод: пытаемся получить заказы через booked_at вместо ended_at
         """
         try:
             logging.info(f"[ORDERS_FALLBACK] Пробуем fallback для driver_id={driver_id}")
             
-            url = f"{self.BASE_URL}/v1/parks/orders/list"
-            
             from datetime import timezone
             now = datetime.now(timezone.utc)
             five_years_ago = now - timedelta(days=1825)
@@ -324,91 +904,121 @@ class YandexParkAPI:
                 "limit": 500
             }
             
-            async with session.post(url, json=payload, headers=self.headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    orders = data.get("orders", [])
-                    completed = [o for o in orders if o.get("status") != "cancelled"]
-                    count = len(completed)
-                    logging.info(f"[ORDERS_FALLBACK] Driver {driver_id}: получено {count} заказов через fallback")
-                    return count
-                else:
-                    logging.warning(f"[ORDERS_FALLBACK] Driver {driver_id}: fallback failed with status {response.status}")
-                    return None
+            status, response_text = await self._request("/v1/parks/orders/list", payload)
+            if status == 200:
+                data = json.loads(response_text)
+                orders = data.get("orders", [])
+                completed = [o for o in orders if o.get("status") != "cancelled"]
+                count = len(completed)
+                logging.info(f"[ORDERS_FALLBACK] Driver {driver_id}: получено {count} заказов через fallback")
+                return count
+            else:
+                logging.warning(f"[ORDERS_FALLBACK] Driver {driver_id}: fallback failed with status {status}")
+                return None
         except Exception as e:
             logging.error(f"[ORDERS_FALLBACK] Ошибка fallback для {driver_id}: {e}")
             return None
     
-    async def get_driver_position(self, driver_id: str) -> Optional[str]:
+    async def get_driver_car(self, driver_id: str) -> Optional[Dict]:
         """
-        Определяет позицию водителя в парке (грузовой/экспресс)
+        Получает автомобиль водителя (марка, модель, cargo_type) через driver-profiles/retrieve
         
         Args:
             driver_id: ID водителя
         
         Returns:
-            "cargo" для грузового, "express" для экспресс, или None
+            Dict с полями автомобиля (пустой, если автомобиль не привязан) или None,
+            если водитель не найден или запрос не удался
         """
+        return await self._single_flight(("driver_car", driver_id), lambda: self._fetch_driver_car(driver_id))
+    
+    async def _fetch_driver_car(self, driver_id: str) -> Optional[Dict]:
+        """Запрос driver-profiles/retrieve для get_driver_car"""
         try:
-            async with aiohttp.ClientSession() as session:
-                url = f"{self.BASE_URL}/v1/parks/driver-profiles/retrieve"
-                
-                payload = {
-                    "fields": {
-                        "driver_profile": ["id", "work_status"],
-                        "car": ["brand", "model", "amenities", "cargo_type"]
-                    },
-                    "query": {
-                        "park": {
-                            "id": self.park_id,
-                            "driver_profile": {
-                                "id": driver_id
-                            }
+            payload = {
+                "fields": {
+                    "driver_profile": ["id", "work_status"],
+                    "car": ["brand", "model", "amenities", "cargo_type"]
+                },
+                "query": {
+                    "park": {
+                        "id": self.park_id,
+                        "driver_profile": {
+                            "id": driver_id
                         }
                     }
                 }
-                
-                async with session.post(url, json=payload, headers=self.headers) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        
-                        # Пытаемся определить позицию по типу автомобиля или amenities
-                        driver_profiles = data.get("driver_profiles", [])
-                        if driver_profiles:
-                            driver = driver_profiles[0]
-                            car = driver.get("car", {})
-                            
-                            # Проверяем cargo_type (если есть)
-                            cargo_type = car.get("cargo_type")
-                            if cargo_type:
-                                # Если cargo_type указывает на грузовой транспорт
-                                if cargo_type in ["cargo", "van", "truck"]:
-                                    return "cargo"
-                                else:
-                                    return "express"
-                            
-                            # Проверяем по марке/модели автомобиля (если есть типичные грузовые марки)
-                            brand = car.get("brand", "").lower()
-                            model = car.get("model", "").lower()
-                            
-                            # Список ключевых слов для грузовых авто
-                            cargo_keywords = ["грузовой", "фургон", "газель", "фиат", "лада largus", "largus", "mercedes", "ford transit", "volkswagen crafter"]
-                            
-                            if any(keyword in brand or keyword in model for keyword in cargo_keywords):
-                                return "cargo"
-                            
-                            # По умолчанию считаем экспрессом
-                            return "express"
-                        
-                        return None
-                    else:
-                        logging.warning(f"Не удалось получить позицию водителя: {response.status}")
-                        return None
+            }
+            
+            status, response_text = await self._request("/v1/parks/driver-profiles/retrieve", payload)
+            if status == 200:
+                data = json.loads(response_text)
+                driver_profiles = data.get("driver_profiles", [])
+                if driver_profiles:
+                    return driver_profiles[0].get("car") or {}
+                return None
+            else:
+                logging.warning(f"Не удалось получить позицию водителя: {status}")
+                return None
                         
         except Exception as e:
             logging.error(f"Ошибка при получении позиции водителя: {e}")
             return None
     
+    def get_roster_car(self, driver_id: str) -> Optional[Dict]:
+        """Автомобиль водителя из загруженного справочника (без запроса к API) или None"""
+        driver = self._roster_drivers.get(driver_id)
+        if driver is None:
+            return None
+        return driver.get("car") or {}
+    
+    @staticmethod
+    def classify_position(car: Dict) -> str:
+        """
+        Определяет позицию водителя в парке по автомобилю
+        
+        Args:
+            car: Поля автомобиля из Fleet API (brand, model, cargo_type)
+        
+        Returns:
+            "cargo" для грузового, "express" для экспресс
+        """
+        # Проверяем cargo_type (если есть)
+        cargo_type = car.get("cargo_type")
+        if cargo_type:
+            # Если cargo_type указывает на грузовой транспорт
+            if cargo_type in ["cargo", "van", "truck"]:
+                return "cargo"
+            else:
+                return "express"
+        
+        # Проверяем по марке/модели автомобиля (если есть типичные грузовые марки)
+        brand = (car.get("brand") or "").lower()
+        model = (car.get("model") or "").lower()
+        
+        # Список ключевых слов для грузовых авто
+        cargo_keywords = ["грузовой", "фургон", "газель", "фиат", "лада largus", "largus", "mercedes", "ford transit", "volkswagen crafter"]
+        
+        if any(keyword in brand or keyword in model for keyword in cargo_keywords):
+            return "cargo"
+        
+        # По умолчанию считаем экспрессом
+        return "express"
+    
+    @staticmethod
+    def _parse_time(value: Optional[str]) -> Optional[datetime]:
+        """Разбирает время из API (ISO 8601, в т.ч. с суффиксом Z); None, если разобрать не удалось"""
+        if not value:
+            return None
+        try:
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+        if parsed.tzinfo is None:
+            from datetime import timezone
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed
+    
     def _normalize_phone(self, phone: str) -> str:
         """
         Нормализует номер телефона, убирая все лишние символы